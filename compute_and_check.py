@@ -6,12 +6,15 @@
 import os
 import argparse
 
+import pandas as pd
+
 import sys
 prj_path = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, prj_path)
 
 from framework.config import conf
 from framework.bench import FactorComputerChecker
+from framework.results import ResultSink
 
 
 parser = argparse.ArgumentParser(description='Compute factor values and scores.')
@@ -20,20 +23,36 @@ parser.add_argument(
     help='start date (default: 20180101)'
 )
 parser.add_argument(
-    '-n', dest='nproc', type=int, default=8,
-    help='number of cores to use for computation (default: 8)'
+    '-n', dest='nproc', type=int, default=None,
+    help='number of cores to use for computation (default: all cores)'
+)
+parser.add_argument(
+    '-j', dest='minute_jobs', type=int, default=1,
+    help='number of processes to evaluate dates of a single minute factor in parallel, ignored with -f (default: 1)'
 )
 parser.add_argument(
     '-t', dest='tr_minute', type=str, default=None,
     help='transaction time, e.g. 0935, 1000, 1300... (default: None, use default keyword mapping)'
 )
+parser.add_argument(
+    '--sweep', dest='sweep', nargs='+', default=None,
+    help='transaction times to compute and check minute factor(s) at, results are written to -o, e.g. --sweep 0945 1000 1015 (default: None)'
+)
 parser.add_argument(
     '-f', dest='factor_file', type=str, default=None,
     help='path to file which containing lines of factor names (default: None)'
 )
 parser.add_argument(
     '-o', dest='result_csv', type=str, default=conf.get('default_result_csv', '/tmp/result.csv'),
-    help=f'path to csv file to write results. works with -f only. (default: {conf.get("default_result_csv", "/tmp/result.csv")})'
+    help=f'path to csv file to write results. works with -f or --sweep only. (default: {conf.get("default_result_csv", "/tmp/result.csv")})'
+)
+parser.add_argument(
+    '--resume', dest='resume', action='store_true',
+    help='skip factors given by -f already checked with the same settings, as recorded in the sqlite db next to -o (default: False)'
+)
+parser.add_argument(
+    '--incremental', dest='incremental', action='store_true',
+    help='only compute and score dates after the last date of existing factor value and excess files (default: False)'
 )
 parser.add_argument(
     '-i', nargs='+', default=[],
@@ -48,17 +67,30 @@ args = parser.parse_args()
 fcc = FactorComputerChecker(
     start_date=args.start_date,
     tr_minute=args.tr_minute,
-    nproc=args.nproc
+    nproc=args.nproc,
+    minute_jobs=args.minute_jobs,
+    incremental=args.incremental
 )
 
 if args.factor_file is not None:
     with open(os.path.abspath(args.factor_file), 'r') as f:
         factor_list = [fac.strip() for fac in f]
-    result = fcc.main_mp(factor_list)
+    # specs of each factor are committed to the db as soon as it is checked
+    sink = ResultSink(os.path.splitext(os.path.abspath(args.result_csv))[0]+'.sqlite')
+    try:
+        result = fcc.main_mp(factor_list, sink=sink, resume=args.resume)
+    finally:
+        sink.close()
     result.to_csv(os.path.abspath(args.result_csv))
 
 if (len(args.factor_name)>0) or (len(args.i)>0):
     factor_names = list(set(args.factor_name).union(set(args.i)))
-    for factor_name in factor_names:
-        _ = fcc.main(factor_name)
+    if args.sweep is not None:
+        result = pd.concat({factor_name: fcc.sweep(factor_name, args.sweep) for factor_name in factor_names})
+        result.index.names = ['factor', 'transaction_time']
+        print(result.to_string())
+        result.to_csv(os.path.abspath(args.result_csv))
+    else:
+        for factor_name in factor_names:
+            _ = fcc.main(factor_name)
 
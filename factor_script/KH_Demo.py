@@ -25,3 +25,20 @@ class KH_Demo(AlphaFactorX):
         res = high.std(axis=0) / low.std(axis=0) * (high.corrwith(low))
         return res
 
+    def minute_batch(self, MinuteLow, MinuteHigh):
+        # same as minute, all days at once: arrays are days x minutes x stocks
+        with np.errstate(divide='ignore', invalid='ignore'):
+            high_std = np.nanstd(MinuteHigh, axis=1, ddof=1)
+            low_std = np.nanstd(MinuteLow, axis=1, ddof=1)
+
+            valid = ~np.isnan(MinuteHigh) & ~np.isnan(MinuteLow)
+            n = valid.sum(axis=1)
+            high = np.where(valid, MinuteHigh, 0.)
+            low = np.where(valid, MinuteLow, 0.)
+            high = np.where(valid, high - high.sum(axis=1, keepdims=True) / n[:, None, :], 0.)
+            low = np.where(valid, low - low.sum(axis=1, keepdims=True) / n[:, None, :], 0.)
+            corr = (high * low).sum(axis=1) / np.sqrt((high * high).sum(axis=1) * (low * low).sum(axis=1))
+
+        res = high_std / low_std * corr
+        return res
+
@@ -5,80 +5,155 @@
 import os
 import sys
 import time
+import json
+import hashlib
 import importlib
 import warnings
 
 import numpy as np
 import pandas as pd
 import multiprocessing as mp
+from collections import Counter
 from tqdm import tqdm
 
 from framework.config import conf
-from framework.utils import (ttest_positive_sided, ttest_negative_sided, check_prediction)
+from framework.utils import (ttest_positive_sided, ttest_negative_sided, check_prediction,
+    factor_discriminability, reference_top_returns, corr_columns, prediction_date_index, get_return_panel,
+    return_panel_mtimes, reference_mtimes)
+from framework.core import minute_data_map, calculate_expressions
+from framework.manifest import scan_factors, factor_entry
+from framework.cache import load_daily, load_pickle, preload_daily
+from framework.profiling import profile, stage, record
+from framework.storage import frame_file, find_frame, read_frame, write_frame
+from framework.factor_store import FactorStore
+from framework.results import ResultCache
+from framework.minute_store import minute_digest
+from framework.vwap import request_vwap
 
 warnings.filterwarnings("ignore", category=RuntimeWarning)
 abs_path = os.path.dirname(os.path.abspath(__file__))
 prj_path = abs_path[:-9] # parent folder of framework subfolder
 
 
+_framework_hash = None
+
+def framework_hash():
+    '''hash of the sources of the framework, results cached by an older framework are not reused'''
+    global _framework_hash
+    if _framework_hash is None:
+        sha = hashlib.sha1()
+        for fn in sorted(os.listdir(abs_path)):
+            if fn.endswith('.py'):
+                with open(abs_path+'/'+fn, 'rb') as f:
+                    sha.update(f.read())
+        _framework_hash = sha.hexdigest()
+
+    return _framework_hash
+
+
+# values of expression factors of a batch computed in the parent, inherited by forked workers, along with the share
+# of each factor in the (wall, cpu) time of computing them
+_precomputed = {}
+_precomputed_time = {}
+
+
 class FactorComputerChecker(object):
     '''Compute and check hf and close factors
     Params:
         start_date: str, start date, default '20180101'
         tr_minute: transaction minute of hf factor, mapped to hf type by default
-        nproc: int, number of cores used for computation when a file with tens of factor names is provided, default 8
+        nproc: int, number of cores used for computation when a file with tens of factor names is provided, default all cores
+        minute_jobs: int, number of processes to evaluate dates of a minute factor in parallel, default 1
+        incremental: bool, only compute and score dates after those in existing factor value and excess files, default False
 
     Returns:
         factor values, scores and specifications.
     '''
-    def __init__(self, start_date='20180101', tr_minute=None, nproc=8):
+    def __init__(self, start_date='20180101', tr_minute=None, nproc=None, minute_jobs=1, incremental=False):
         self.start_date_ = start_date
         self.tr_minute_ = tr_minute
-        self.nproc_ = nproc
+        self.nproc_ = nproc if nproc else os.cpu_count()
+        self.minute_jobs_ = minute_jobs
+        self.incremental_ = incremental
         self.time_map_ = {"KD": "0935", "KH": "1000", "KJ": "1300", "KL": "1450", "KFC": "1500"}
 
 
-    def compute_factor_value(self, factor_name):
-        tic = time.perf_counter()
-        mod = importlib.import_module(conf.get('factor_script_dir', 'factor_script')+'.'+factor_name)
-        obj = getattr(mod, factor_name)(start_date=self.start_date_)
-
+    def get_catalog(self, factor_name):
+        '''catalog type and transaction time of a factor'''
         hfs = ['KD', 'KH', 'KJ', 'KL']
         if not any([factor_name.startswith(i) for i in hfs]):
-            self.catalog_type_ = 'KFC'
-            self.transaction_time_ = '1500'
+            return 'KFC', '1500'
+
+        catalog_type = factor_name.split('_')[0]
+        if not self.tr_minute_:
+            return catalog_type, self.time_map_[catalog_type]
         else:
-            self.catalog_type_ = factor_name.split('_')[0]
+            return catalog_type, self.tr_minute_
 
-            if not self.tr_minute_:
-                self.transaction_time_ = self.time_map_[self.catalog_type_]
-            else:
-                self.transaction_time_ = self.tr_minute_
-                map_time = pd.Timestamp(f'20200202 {self.transaction_time_}') - pd.Timedelta('1 minute')
-                obj.hf_map_.update({self.catalog_type_: map_time.strftime(r'%H%M')})
+
+    def compute_factor_value(self, factor_name):
+        tic = time.perf_counter()
+        with stage('import'):
+            mod = importlib.import_module(conf.get('factor_script_dir', 'factor_script')+'.'+factor_name)
+
+        self.catalog_type_, self.transaction_time_ = self.get_catalog(factor_name)
+
+        value_dir = prj_path+conf.get('factor_value_dir', 'factor_values')+'/'
+        value_file = frame_file(value_dir, factor_name)
+        start_date = self.start_date_
+        old_df = None
+        if self.incremental_ and (find_frame(value_dir, factor_name) is not None):
+            old_df = read_frame(find_frame(value_dir, factor_name))
+            trade_dates = load_daily('adjfactor').index
+            new_dates = trade_dates[trade_dates > old_df.index[-1]]
+            if len(new_dates) == 0:
+                print(f'@@@@ {factor_name} is up to date\n')
+                return old_df
+            start_date = new_dates[0].strftime(r'%Y%m%d')
+
+        obj = getattr(mod, factor_name)(start_date=start_date)
+        # set after construction, as factors may override __init__ with start_date only. daemonic batch workers can
+        # not fork workers of their own
+        obj.n_jobs_ = 1 if mp.current_process().daemon else self.minute_jobs_
+        if (self.catalog_type_ != 'KFC') and self.tr_minute_:
+            map_time = pd.Timestamp(f'20200202 {self.transaction_time_}') - pd.Timedelta('1 minute')
+            obj.hf_map_.update({self.catalog_type_: map_time.strftime(r'%H%M')})
         
-        print(f'@@@@ Begin to compute the {self.catalog_type_} factor {factor_name}\n')
-        factor_df = obj.calculate()
-        if self.catalog_type_ == 'KFC':
-            factor_df.loc[pd.Timestamp('20200203')] = np.nan
+        print(f'@@@@ Begin to compute the {self.catalog_type_} factor {factor_name} from {start_date}\n')
+        factor_df = _precomputed.pop(factor_name, None) if old_df is None else None
+        if factor_df is None:
+            factor_df = obj.calculate()
         else:
-            factor_df.loc[pd.Timestamp('20200203'):pd.Timestamp('20200204')] = np.nan
-
-        factor_df.to_pickle(prj_path+conf.get('factor_value_dir', 'factor_values')+'/'+factor_name+'.pkl')
+            record('definition', *_precomputed_time[factor_name])
+        if old_df is not None:
+            factor_df = pd.concat([old_df, factor_df])
+        self.blank_abnormal_dates(factor_df)
+
+        with stage('write'):
+            write_frame(factor_df, value_file)
+            if conf.get('factor_store_dir', ''):
+                FactorStore().write(factor_name, factor_df)
         toc = time.perf_counter()
         print(f"#### Factor Computing Time: {toc-tic:0.2f} seconds.")
 
         return factor_df
         
 
+    def blank_abnormal_dates(self, factor_df):
+        '''values on abnormal trading dates are not used, in place'''
+        if self.catalog_type_ == 'KFC':
+            factor_df.loc[pd.Timestamp('20200203')] = np.nan
+        else:
+            factor_df.loc[pd.Timestamp('20200203'):pd.Timestamp('20200204')] = np.nan
+
+
     def compute_factor_score(self, factor_name):
         # cal factor values
         factor_df = self.compute_factor_value(factor_name)
-        nan_ratio = np.round(factor_df.isna().mean(axis=1).mean(), 4)
+        with stage('scoring'):
+            factor_unique_count, factor_mode_count, nan_ratio = factor_discriminability(factor_df)
         print(f'#### p(nan): {nan_ratio:.2%}\n')
 
-        factor_unique_count = factor_df.apply(lambda x: len(pd.Series.unique(x)), axis=1).mean()
-        factor_mode_count = factor_df.apply(lambda x: x.value_counts(sort=False).max(), axis=1, raw=False).mean()
         if (factor_unique_count<=200):
             print('warning: factor values not discriminative!\n')
         if (factor_mode_count>=300):
@@ -87,23 +162,42 @@ class FactorComputerChecker(object):
 
         # cal score
         if self.catalog_type_ == 'KFC':
-            py_path = prj_path+conf.get('factor_script_dir', 'factor_script')+'/'+factor_name+'.py'
-            score = check_prediction(
-                factor_df.shift(2),
-                act_type='close',
-                buy_price='vwap',
-                filter_close_fac=py_path,
-                group_number=20
-            )
+            act = factor_df.shift(2)
         else:
-            score = check_prediction(
-                factor_df.shift(1),
-                act_type='minute',
-                transaction_time=self.transaction_time_,
-                group_number=20
-            )
-
-        score.to_pickle(prj_path+conf.get('factor_excess_dir', 'factor_excess')+'/'+factor_name+'_excess.pkl')
+            act = factor_df.shift(1)
+
+        excess_dir = prj_path+conf.get('factor_excess_dir', 'factor_excess')+'/'
+        excess_file = frame_file(excess_dir, factor_name+'_excess')
+        old_score = None
+        if self.incremental_ and (find_frame(excess_dir, factor_name+'_excess') is not None):
+            # only rows after the last scored date are rescored
+            old_score = read_frame(find_frame(excess_dir, factor_name+'_excess'))
+            act = act.loc[act.index > old_score.index[-1]]
+            if len(act) == 0:
+                return old_score, discrim, nan_ratio
+
+        with stage('scoring'):
+            if self.catalog_type_ == 'KFC':
+                py_path = prj_path+conf.get('factor_script_dir', 'factor_script')+'/'+factor_name+'.py'
+                score = check_prediction(
+                    act,
+                    act_type='close',
+                    buy_price='vwap',
+                    filter_close_fac=py_path,
+                    group_number=20
+                )
+            else:
+                score = check_prediction(
+                    act,
+                    act_type='minute',
+                    transaction_time=self.transaction_time_,
+                    group_number=20
+                )
+
+        if old_score is not None:
+            score = pd.concat([old_score, score])
+        with stage('write'):
+            write_frame(score, excess_file)
 
         return score, discrim, nan_ratio
 
@@ -194,17 +288,9 @@ class FactorComputerChecker(object):
 
         print('####### TEST-3. max correlation of top return series #######')
         try:
-            valid_facs = pd.read_pickle(conf.get('valid_factors_file', None)).loc[self.transaction_time_].index
-            if self.catalog_type_ == 'KFC':
-                fac_all = pd.read_pickle(conf.get('all_kfc_excess_file', None))[valid_facs]
-            else:
-                fac_all = pd.read_pickle(conf.get('all_hf_excess_file', None))[self.transaction_time_][valid_facs]
-
-            fac_top_group = fac_all.groupby(level=0, axis=0).mean().apply(pd.Series.idxmax)
-
-            fac_top_rets = fac_all.apply(lambda x: x[fac_top_group[x.name]])
-
-            corr_top = fac_top_rets.corrwith(whole_top_series).sort_values(ascending=False) # no abs
+            ref_dates, ref_names, ref_top_rets = reference_top_returns(self.transaction_time_, self.catalog_type_)
+            corr_top = corr_columns(ref_top_rets, whole_top_series.reindex(ref_dates).values)
+            corr_top = pd.Series(corr_top, index=ref_names).sort_values(ascending=False) # no abs
 
             print(f'max corr. info: {corr_top.index[0]}, {corr_top.iloc[0]:0.4f}')
 
@@ -225,26 +311,253 @@ class FactorComputerChecker(object):
 
 
     def main(self, factor_name):
-        score, discrim, nan_ratio = self.compute_factor_score(factor_name)
-        specs = self.score_eval(factor_name, score, discrim, nan_ratio)
+        with profile(factor_name) as profiler:
+            key = None
+            if conf.get('cache_dir', '') and not self.incremental_:
+                with stage('import'):
+                    key = self.result_key(factor_name)
+            value_file = frame_file(prj_path+conf.get('factor_value_dir', 'factor_values')+'/', factor_name)
+            excess_file = frame_file(prj_path+conf.get('factor_excess_dir', 'factor_excess')+'/', factor_name+'_excess')
+            cache = ResultCache(conf.get('cache_dir', '')+'results/')
+
+            specs = None if key is None else cache.restore(key, [value_file, excess_file])
+            if specs is not None:
+                print(f'@@@@ {factor_name} unchanged since last check, results restored from cache\n')
+                self.catalog_type_, self.transaction_time_ = self.get_catalog(factor_name)
+                if conf.get('factor_store_dir', ''):
+                    with stage('write'):
+                        FactorStore().write(factor_name, read_frame(value_file))
+            else:
+                score, discrim, nan_ratio = self.compute_factor_score(factor_name)
+                with stage('score_eval'):
+                    specs = self.score_eval(factor_name, score, discrim, nan_ratio)
+                if key is not None:
+                    with stage('write'):
+                        cache.put(key, [value_file, excess_file], specs)
+        self.profiler_ = profiler
 
         return specs
 
 
-    def main_mp(self, factor_list):
-        '''multiprocessing, stdout replaced by progress bar'''
-        old_stdout = sys.stdout
-        sys.stdout = open(os.devnull, 'w')
-        try:
+    def result_key(self, factor_name):
+        '''key of the results of factor_name in the result cache: a hash of the source of its module and of the
+        framework, settings of the check, its params and mtimes of the data it reads or is scored against.
+        the module is imported only if its params are not literal.
+        '''
+        entry = factor_entry(factor_name)
+        params = entry['params']
+        if params is None:
+            mod = importlib.import_module(conf.get('factor_script_dir', 'factor_script')+'.'+factor_name)
+            params = object.__new__(getattr(mod, factor_name)).set_param()
+        catalog_type, transaction_time = self.get_catalog(factor_name)
+
+        varnames = set(['adjfactor'])
+        for func in entry['functions'].values():
+            varnames.update(func['args'])
+        files = [conf.get('daily_data_path', '')+d+'.pkl' for d in sorted(varnames) if 'Minute' not in d]
+        files.append(conf.get('valid_minute_path', '')+transaction_time+'.pkl')
+        mtimes = [os.path.getmtime(f) if os.path.exists(f) else None for f in files]
+        trade_dates = load_daily('adjfactor').index
+        fields = sorted(set([minute_data_map[d] for d in varnames if d in minute_data_map]))
+        if len(fields) > 0:
+            # every minute file read from the first date of the lookback on, a file rewritten in place included
+            dates = trade_dates[trade_dates >= pd.Timestamp('20150101')]
+            prelen = params.get('prelength', 0) + params.get('min_prelen', 0)
+            first = max(dates.searchsorted(pd.Timestamp(self.start_date_)) - prelen, 0)
+            mtimes.append(minute_digest(fields, dates[first:].strftime(r'%Y%m%d').tolist()))
+        date_index = prediction_date_index(trade_dates[trade_dates >= pd.Timestamp(self.start_date_)])
+        mtimes += return_panel_mtimes(date_index, 'close' if catalog_type == 'KFC' else 'minute', 'vwap')
+        mtimes += reference_mtimes(catalog_type)
+
+        item = {
+            'factor': factor_name,
+            'source': entry['sha1'],
+            'framework': framework_hash(),
+            'params': params,
+            'start_date': self.start_date_,
+            'tr_minute': self.tr_minute_,
+            'storage_format': conf.get('storage_format', 'pickle'),
+            'mtimes': mtimes,
+        }
+
+        return factor_name+'_'+hashlib.sha1(json.dumps(item, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+    def timed_main(self, factor_name):
+        '''main with stage stats merged into specs, for batches'''
+        tic = time.perf_counter()
+        specs = self.main(factor_name)
+        specs = pd.concat([specs, pd.Series(self.profiler_.summary(), dtype=object)])
+        specs.name = factor_name
+        # with its share of the precomputed expressions, so that the next batch schedules it by its full cost
+        elapsed = time.perf_counter() - tic + _precomputed_time.get(factor_name, (0., 0.))[0]
+
+        return specs, elapsed
+
+
+    def sweep(self, factor_name, transaction_times):
+        '''compute and check a minute factor at each of transaction_times, e.g. ['0945', '1000', '1015'].
+        minute data is read once for all transaction times, factor values and excess are not written to files.
+        Returns:
+            pandas.DataFrame, specifications indexed by transaction time
+        '''
+        with profile(factor_name) as profiler:
+            with stage('import'):
+                mod = importlib.import_module(conf.get('factor_script_dir', 'factor_script')+'.'+factor_name)
+            self.catalog_type_, _ = self.get_catalog(factor_name)
+            assert self.catalog_type_ != 'KFC', 'only minute factors can be swept over transaction times!!!'
+
+            obj = getattr(mod, factor_name)(start_date=self.start_date_)
+            obj.n_jobs_ = 1 if mp.current_process().daemon else self.minute_jobs_
+            cutoffs = {}
+            for tt in transaction_times:
+                map_time = pd.Timestamp(f'20200202 {tt}') - pd.Timedelta('1 minute')
+                cutoffs[tt] = map_time.strftime(r'%H%M')
+            print(f'@@@@ Begin to compute the {self.catalog_type_} factor {factor_name} at {", ".join(transaction_times)}\n')
+            values = obj.calculate_sweep(list(cutoffs.values()))
+            # vwap of all transaction times from one scan of minute files
+            request_vwap(prediction_date_index(values[cutoffs[transaction_times[0]]].index), transaction_times)
+
             rs = []
-            with mp.Pool(processes=self.nproc_) as p:
-                for r in tqdm(p.imap_unordered(self.main, factor_list), total=len(factor_list)):
-                    rs.append(r)
-        finally:
-            sys.stdout.close()
-            sys.stdout = old_stdout
+            for tt in transaction_times:
+                print(f'@@@@ Transaction time {tt}\n')
+                self.transaction_time_ = tt
+                factor_df = values[cutoffs[tt]]
+                self.blank_abnormal_dates(factor_df)
+                with stage('scoring'):
+                    factor_unique_count, factor_mode_count, nan_ratio = factor_discriminability(factor_df)
+                    discrim = (factor_unique_count>200) and (factor_mode_count<300)
+                    score = check_prediction(factor_df.shift(1), act_type='minute', transaction_time=tt, group_number=20)
+                with stage('score_eval'):
+                    specs = self.score_eval(factor_name, score, discrim, nan_ratio)
+                specs.name = tt
+                rs.append(specs)
+        self.profiler_ = profiler
+
+        result = pd.concat(rs, axis=1).T
+        result.index.name = 'transaction_time'
+
+        return result
+
+
+    def warm_up(self, factor_list):
+        '''load inputs shared by factors of the same catalog type and transaction time once, before forking workers'''
+        # daily fields read by more than one factor of the batch are loaded once here too
+        manifest = scan_factors()
+        counts = Counter([d for f in factor_list if f in manifest for d in manifest[f]['daily_fields']])
+        shared = sorted([d for d, n in counts.items() if n > 1])
+        preload_daily(['adjfactor', 'vwap', 'pre_close', 'is_valid_raw'] + shared)
+        if self.incremental_:
+            return
+
+        trade_dates = load_daily('adjfactor').index
+        date_index = prediction_date_index(trade_dates[trade_dates >= pd.Timestamp(self.start_date_)])
+        for catalog_type, transaction_time in sorted(set([self.get_catalog(f) for f in factor_list])):
+            try:
+                if catalog_type == 'KFC':
+                    get_return_panel(date_index, 'close', 'vwap', '1500')
+                else:
+                    get_return_panel(date_index, 'minute', 'vwap', transaction_time)
+                load_pickle(conf.get('valid_minute_path', '')+transaction_time+'.pkl')
+                reference_top_returns(transaction_time, catalog_type)
+            except (KeyError, OSError):
+                pass
+
+
+    def cached(self, factor_name):
+        '''whether results of factor_name would be restored from the result cache by main'''
+        if (not conf.get('cache_dir', '')) or self.incremental_:
+            return False
+
+        return os.path.exists(conf.get('cache_dir', '')+'results/'+self.result_key(factor_name)+'/specs.pkl')
+
+
+    def precompute_expressions(self, factor_list):
+        '''values of factors of the batch defined by expression, from their merged graph, see calculate_expressions.
+        factors whose results are cached are left out, nothing is computed for fewer than two factors.
+        '''
+        _precomputed.clear()
+        _precomputed_time.clear()
+        if self.incremental_:
+            return
+        manifest = scan_factors()
+        names = [f for f in factor_list if 'expression' in manifest.get(f, {}).get('functions', {})]
+        names = [f for f in names if not self.cached(f)]
+        if len(names) < 2:
+            return
+
+        objs = []
+        for f in names:
+            mod = importlib.import_module(conf.get('factor_script_dir', 'factor_script')+'.'+f)
+            objs.append(getattr(mod, f)(start_date=self.start_date_))
+        wall, cpu = time.perf_counter(), time.process_time()
+        _precomputed.update(calculate_expressions(objs))
+        # shared subexpressions make the cost of a factor undefined, it is split evenly and added to the definition
+        # stage of each factor in its worker
+        wall, cpu = (time.perf_counter() - wall) / len(objs), (time.process_time() - cpu) / len(objs)
+        _precomputed_time.update({f: (wall, cpu) for f in _precomputed})
+
+
+    def load_timings(self):
+        '''computing time of factors in previous batches, kept under cache_dir'''
+        timing_file = conf.get('cache_dir', '')+'timings.json'
+        if conf.get('cache_dir', '') and os.path.exists(timing_file):
+            with open(timing_file, 'r') as f:
+                return json.load(f)
+
+        return {}
+
+
+    def save_timings(self, timings):
+        if conf.get('cache_dir', ''):
+            os.makedirs(conf.get('cache_dir', ''), exist_ok=True)
+            with open(conf.get('cache_dir', '')+'timings.json', 'w') as f:
+                json.dump(timings, f)
+
+
+    def settings(self):
+        '''settings that results of a check depend on, besides the factor itself'''
+        return {'start_date': self.start_date_, 'tr_minute': self.tr_minute_}
+
+
+    def main_mp(self, factor_list, sink=None, resume=False):
+        '''multiprocessing, stdout replaced by progress bar.
+        shared inputs are loaded in the parent and inherited copy-on-write by forked workers, factors taking longest
+        in previous batches (or never timed) are scheduled first to avoid a straggler tail. factors defined by
+        expression are computed together in the parent, sharing common subexpressions.
+        Params:
+            factor_list: list of str, factor names
+            sink: ResultSink, specs of each factor are stored as soon as it is checked, default None
+            resume: bool, skip factors found in sink with the same settings, default False
+        '''
+        settings = self.settings()
+        done = sink.factors(settings) if (sink is not None) and resume else set()
+        todo = [f for f in factor_list if f not in done]
+        rs = [sink.get(f, settings) for f in sorted(set(factor_list) & done)]
+
+        if len(todo) > 0:
+            self.warm_up(todo)
+            self.precompute_expressions(todo)
+            timings = self.load_timings()
+            todo = sorted(todo, key=lambda f: -timings.get(f, np.inf))
+
+            ctx = mp.get_context('fork') if 'fork' in mp.get_all_start_methods() else mp.get_context()
+            old_stdout = sys.stdout
+            sys.stdout = open(os.devnull, 'w')
+            try:
+                with ctx.Pool(processes=self.nproc_) as p:
+                    for specs, elapsed in tqdm(p.imap_unordered(self.timed_main, todo), total=len(todo)):
+                        if sink is not None:
+                            sink.put(specs, settings)
+                        rs.append(specs)
+                        timings[specs.name] = elapsed
+            finally:
+                sys.stdout.close()
+                sys.stdout = old_stdout
+                self.save_timings(timings)
+                _precomputed.clear()
+                _precomputed_time.clear()
 
         result = pd.concat(rs, axis=1).T.sort_index(axis=0)
 
         return result
-
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+# process-wide cache of daily panels, so adjfactor, vwap etc. are unpickled once per process instead of
+# once per entry point. main_mp preloads the common panels before forking workers, which then share them
+# copy-on-write instead of each holding its own copy.
+
+import os
+from collections import OrderedDict
+
+import pandas as pd
+
+from framework.config import conf
+
+
+class PickleCache(object):
+    '''LRU cache of unpickled objects keyed by file path, reloaded when the file's mtime changes.
+    Params:
+        budget_mb: int, memory budget in MB, least recently used objects are evicted beyond it
+
+    Returns:
+        PickleCache, cached objects are shared and must not be modified in place.
+    '''
+    def __init__(self, budget_mb=4096):
+        self.budget_ = budget_mb * 2**20
+        self.items_ = OrderedDict()
+        self.nbytes_ = 0
+
+
+    def get(self, path):
+        mtime = os.path.getmtime(path)
+        item = self.items_.get(path)
+        if (item is not None) and (item[0] == mtime):
+            self.items_.move_to_end(path)
+            return item[1]
+
+        obj = pd.read_pickle(path)
+        self.put(path, mtime, obj)
+
+        return obj
+
+
+    def put(self, path, mtime, obj):
+        self.pop(path)
+        if isinstance(obj, (pd.DataFrame, pd.Series)):
+            nbytes = int(obj.memory_usage(index=True, deep=False).sum())
+        else:
+            nbytes = 0
+        if nbytes > self.budget_:
+            return
+
+        self.items_[path] = (mtime, obj, nbytes)
+        self.nbytes_ += nbytes
+        while self.nbytes_ > self.budget_:
+            _, (_, _, n) = self.items_.popitem(last=False)
+            self.nbytes_ -= n
+
+
+    def pop(self, path):
+        item = self.items_.pop(path, None)
+        if item is not None:
+            self.nbytes_ -= item[2]
+
+
+    def clear(self):
+        self.items_.clear()
+        self.nbytes_ = 0
+
+
+_cache = None
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        _cache = PickleCache(conf.get('daily_cache_mb', 4096))
+
+    return _cache
+
+
+def load_pickle(path):
+    '''cached pd.read_pickle, the returned object is shared and must not be modified in place'''
+    return get_cache().get(path)
+
+
+def load_daily(name):
+    '''cached daily panel under daily_data_path, e.g. load_daily('adjfactor')'''
+    return load_pickle(conf.get('daily_data_path', '')+name+'.pkl')
+
+
+def preload_daily(names):
+    '''load daily panels into the cache, called before forking workers to share them'''
+    for name in names:
+        if os.path.exists(conf.get('daily_data_path', '')+name+'.pkl'):
+            load_daily(name)
@@ -6,12 +6,22 @@
 conf = {
     'daily_data_path': '',
     'minute_data_path': '',
+    'minute_store_path': '',
     'valid_minute_path': '',
+    'daily_cache_mb': 4096,
+    'minute_batch_days': 60,
+    'minute_prefetch_days': 4,
+    'precision': 'float64',
     'valid_factors_file': '',
     'all_kfc_excess_file': '',
     'all_hf_excess_file': '',
     'factor_script_dir': 'factor_script',
     'factor_value_dir': 'factor_values',
     'factor_excess_dir': 'factor_excess',
+    'factor_store_dir': '',
+    'storage_format': 'pickle',
+    'storage_compression': 'zstd',
+    'cache_dir': '',
+    'profile_log': '',
     'default_result_csv': ''
 }
@@ -6,22 +6,37 @@ import os
 from datetime import datetime
 import inspect
 import re
+from collections import deque
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 import pandas as pd
 import numpy as np
 
 from framework.config import conf
+from framework.minute_store import read_minute, read_minute_cube
+from framework.cache import load_daily
+from framework.profiling import stage
+from framework.manifest import file_manifest
+from framework.precision import float_dtype, to_precision
+from framework.expr import evaluate, fields
+
+
+# parameter names of minute data to their dirs under minute_data_path
+minute_data_map = {'Minute'+m: m for m in ['High', 'Low', 'Open', 'Close', 'Turnover', 'Volume']}
+minute_data_map.update({'MinuteTurnover': 'Amount'})
 
 
 class AlphaFactorX(object):
     '''Core component of alpha factor development framework. Base class for factor modules to inherit.
     Params:
         start_date: str, start date to have a value.
+        n_jobs: int, number of processes to evaluate dates of minute function in parallel, default 1
 
     Returns:
         pandas.DataFrame, factor values
     '''
-    def __init__(self, start_date='20180101'):
+    def __init__(self, start_date='20180101', n_jobs=1):
         params = self.set_param()
         self.prelen_ = params.get('prelength', 0)
         self.mprelen_ = params.get('min_prelen', 0)
@@ -35,8 +50,12 @@ class AlphaFactorX(object):
 
         self.daily_data_path_ = conf.get('daily_data_path', '')
         self.minute_data_path_ = conf.get('minute_data_path', '')
+        self.n_jobs_ = n_jobs
+        self.cutoffs_ = [] # cutoffs of a sweep, see calculate_sweep
+        self.sweep_ = {} # minute_help results of a sweep by cutoff
 
-        adjfactor = pd.read_pickle(self.daily_data_path_+'adjfactor.pkl').loc[pd.Timestamp('20150101'):]
+        with stage('daily_load'):
+            adjfactor = load_daily('adjfactor').loc[pd.Timestamp('20150101'):]
         self.start_date_ = pd.Timestamp(start_date)
         if self.prelen_+self.mprelen_ > 0:
             start_date_pre = self.start_date_ - pd.Timedelta('1 day')
@@ -44,11 +63,10 @@ class AlphaFactorX(object):
             self.start_date_pre_ = adjfactor.loc[:start_date_pre].index[-self.prelen_-self.mprelen_]
         else:
             self.start_date_pre_ = self.start_date_
-        self.adj_ = adjfactor.loc[self.start_date_pre_:]
+        self.adj_ = adjfactor.loc[self.start_date_pre_:].copy()
         self.date_list_ = self.adj_.index[self.mprelen_:].strftime(r'%Y%m%d').tolist()
 
-        self.minute_data_map_ = {'Minute'+m: m for m in ['High', 'Low', 'Open', 'Close', 'Turnover', 'Volume']}
-        self.minute_data_map_.update({'MinuteTurnover': 'Amount'})
+        self.minute_data_map_ = dict(minute_data_map)
 
 
     def get_factype(self):
@@ -63,6 +81,14 @@ class AlphaFactorX(object):
 
 
     def get_vars_unused(self, func):
+        # from the manifest of the module if func is defined by this class, parsed once per module
+        try:
+            entry = file_manifest(inspect.getfile(type(self)))['classes'].get(type(self).__name__)
+        except (TypeError, OSError, SyntaxError):
+            entry = None
+        if (entry is not None) and (func.__name__ in entry['functions']) and (func.__qualname__.split('.')[0] == type(self).__name__):
+            return entry['functions'][func.__name__]['args'], entry['functions'][func.__name__]['unused']
+
         varnames = inspect.getfullargspec(func).args[1:] # exclude self
         code_lines = [l.strip() for l in inspect.getsourcelines(func)[0] if not l.strip().startswith('#')]
         codes = ' '.join(code_lines)
@@ -71,75 +97,273 @@ class AlphaFactorX(object):
         return varnames, unused
 
     
+    def minute_daily_data(self, varnames, unused):
+        '''daily data required by minute function'''
+        daily_data = {}
+        with stage('daily_load'):
+            for d in varnames:
+                if (d in unused) or ('Minute' in d):
+                    continue
+
+                if d == 'adjfactor':
+                    daily_data[d] = to_precision(self.adj_)
+                    continue
+
+                if self.fac_type_ == 'KFC':
+                    daily_data[d] = to_precision(load_daily(d).loc[self.start_date_pre_:])
+                else:
+                    daily_data[d] = to_precision(load_daily(d).shift(1).loc[self.start_date_pre_:])
+
+        return daily_data
+
+
     def minute_help(self):
+        cutoff = self.hf_map_[self.fac_type_]
+        if cutoff in self.sweep_:
+            return self.sweep_[cutoff].copy()
+        # in a sweep, values at all cutoffs are computed from one pass over minute data
+        cutoffs = self.cutoffs_ if cutoff in self.cutoffs_ else [cutoff]
+
+        # minute_batch gets days without the minutes of previous days, so factors with min_prelen keep minute
+        if (type(self).minute_batch is not AlphaFactorX.minute_batch) and (self.mprelen_ == 0):
+            factors = self.minute_batch_help(cutoffs)
+        else:
+            factors = self.minute_chunks(cutoffs)
+
+        if len(cutoffs) == 1:
+            return factors[cutoff]
+        self.sweep_ = factors
+
+        return factors[cutoff].copy()
+
+
+    def minute_chunks(self, cutoffs):
+        '''minute factor values at each of cutoffs, dates evaluated serially or in parallel by n_jobs processes'''
         varnames, unused = self.get_vars_unused(self.minute)
+        daily_data = self.minute_daily_data(varnames, unused)
+        
+        n_dates = len(self.adj_.index)
+        n_jobs = min(self.n_jobs_, n_dates-self.mprelen_)
+        if (n_jobs <= 1) or ('fork' not in mp.get_all_start_methods()):
+            factors = self.minute_range(self.mprelen_, n_dates, varnames, unused, daily_data, cutoffs)
+        else:
+            # contiguous chunks of dates, each worker reads its own minute files incl. min_prelen days ahead
+            bounds = np.linspace(self.mprelen_, n_dates, n_jobs+1).astype(int)
+            global _minute_job
+            _minute_job = (self, varnames, unused, daily_data, cutoffs) # inherited by forked workers
+            try:
+                with stage('minute'):
+                    with ProcessPoolExecutor(max_workers=n_jobs, mp_context=mp.get_context('fork')) as executor:
+                        chunks = list(executor.map(_minute_range_job, bounds[:-1], bounds[1:]))
+            finally:
+                _minute_job = None
+            factors = {cutoff: {} for cutoff in cutoffs}
+            for chunk in chunks:
+                for cutoff in cutoffs:
+                    factors[cutoff].update(chunk[cutoff])
+
+        factors = {cutoff: pd.DataFrame(factors[cutoff]).T for cutoff in cutoffs}
+
+        return factors
 
-        daily_data = {}
-        for d in varnames:
-            if (d in unused) or ('Minute' in d):
-                continue
 
-            if d == 'adjfactor':
-                daily_data[d] = self.adj_
+    def minute_range(self, lo, hi, varnames, unused, daily_data, cutoffs):
+        '''minute factor values on dates self.adj_.index[lo:hi] at each of cutoffs, lo >= min_prelen'''
+        # rolling window of the last min_prelen+1 days, each minute file is read only once
+        minute_vars = [d for d in varnames if ('Minute' in d) and (d not in unused)]
+        windows = {d: deque(maxlen=self.mprelen_+1) for d in minute_vars}
+
+        factors = {cutoff: {} for cutoff in cutoffs}
+        dates = self.adj_.index[lo-self.mprelen_:hi].strftime(r'%Y%m%d').tolist()
+        for k, data in enumerate(self.prefetch_minute(dates, minute_vars)):
+            i, date = lo-self.mprelen_+k, dates[k]
+            for d in minute_vars:
+                windows[d].append(data[d])
+            if i < lo:
                 continue
 
-            if self.fac_type_ == 'KFC':
-                daily_data[d] = pd.read_pickle(self.daily_data_path_+d+'.pkl').loc[self.start_date_pre_:]
-            else:
-                daily_data[d] = pd.read_pickle(self.daily_data_path_+d+'.pkl').shift(1).loc[self.start_date_pre_:]
-        
-        factors = {}
-        for date in self.date_list_:
-            compute_dates = self.adj_.loc[:date].index[-self.mprelen_-1:]
+            compute_dates = self.adj_.index[i-self.mprelen_:i+1]
 
-            compute_data = {}
-            for d in varnames:
-                if d in unused:
-                    compute_data[d] = None
-                    continue
+            for cutoff in cutoffs:
+                compute_data = {}
+                for d in varnames:
+                    if d in unused:
+                        compute_data[d] = None
+                        continue
 
-                if 'Minute' not in d:
-                    compute_data[d] = daily_data[d].loc[compute_dates]
-                    continue
+                    if 'Minute' not in d:
+                        compute_data[d] = daily_data[d].loc[compute_dates]
+                        continue
 
-                compute_data[d] = pd.DataFrame()
-                if self.mprelen_ > 0:
-                    for compute_date in compute_dates[:-1]:
-                        tmp = pd.read_pickle(self.minute_data_path_+self.minute_data_map_[d]+'/'+compute_date.strftime(r'%Y%m%d')+'.pkl')
-                        compute_data[d] = compute_data[d].append(tmp)
-                else:
-                    pass
-                tmp = pd.read_pickle(self.minute_data_path_+self.minute_data_map_[d]+'/'+date+'.pkl').loc[:date+self.hf_map_[self.fac_type_]]
-                compute_data[d] = compute_data[d].append(tmp)
+                    frames = list(windows[d])
+                    frames[-1] = frames[-1].loc[:date+cutoff]
+                    if len(frames) > 1:
+                        compute_data[d] = pd.concat(frames)
+                    else:
+                        # other cutoffs share the day, in-place edits in minute must not leak into them
+                        compute_data[d] = frames[-1].copy() if len(cutoffs) > 1 else frames[-1]
+
+                with stage('minute'):
+                    factors[cutoff][pd.Timestamp(date)] = self.minute(*[compute_data[var] for var in varnames])
 
-            factors[pd.Timestamp(date)] = self.minute(*[compute_data[var] for var in varnames])
+        return factors
 
-        factors = pd.DataFrame(factors).T
+
+    def prefetch_minute(self, dates, fields):
+        '''minute data of fields on each of dates in order, as dicts of field to pandas.DataFrame. files of the next
+        conf['minute_prefetch_days'] dates are read by background threads while the current date is computed,
+        read serially if 0.
+        '''
+        depth = conf.get('minute_prefetch_days', 4)
+        if (depth <= 0) or (len(fields) == 0):
+            for date in dates:
+                with stage('minute_load'):
+                    data = {d: self.read_minute(d, date) for d in fields}
+                yield data
+            return
+
+        # futures of the dates ahead, at most depth+1 dates are held in memory
+        queue = deque()
+        todo = iter(dates)
+        with ThreadPoolExecutor(max_workers=min(depth*len(fields), 16)) as executor:
+            def submit():
+                date = next(todo, None)
+                if date is not None:
+                    queue.append({d: executor.submit(self.read_minute, d, date) for d in fields})
+
+            try:
+                for _ in range(depth+1):
+                    submit()
+                while len(queue) > 0:
+                    futures = queue.popleft()
+                    submit()
+                    with stage('minute_load'): # time spent waiting for reads
+                        data = {d: f.result() for d, f in futures.items()}
+                    yield data
+            finally:
+                for futures in queue:
+                    for f in futures.values():
+                        f.cancel()
+
+
+    def minute_batch_help(self, cutoffs):
+        '''minute_help for factors defining minute_batch, which gets days of data at once:
+        (days x minutes x stocks) arrays of minute data up to the cutoff of the factor type and (days x stocks) arrays
+        of daily data, and returns (days x stocks) factor values. days are fed in chunks of conf['minute_batch_days'].
+        '''
+        assert self.mprelen_ == 0, 'minute_batch requires min_prelen to be 0!!!'
+        varnames, unused = self.get_vars_unused(self.minute_batch)
+        daily_data = self.minute_daily_data(varnames, unused)
+
+        stocks = self.adj_.columns
+        dates = self.date_list_
+        chunk = conf.get('minute_batch_days', 60)
+
+        factors = {cutoff: [] for cutoff in cutoffs}
+        for i in range(0, len(dates), chunk):
+            chunk_dates = dates[i:i+chunk]
+            chunk_index = pd.to_datetime(chunk_dates)
+
+            cubes = {}
+            for d in varnames:
+                if (d not in unused) and ('Minute' in d):
+                    with stage('minute_load'):
+                        cube, minutes = read_minute_cube(self.minute_data_map_[d], chunk_dates, stocks, max(cutoffs))
+                        cubes[d] = (to_precision(cube), minutes)
+
+            for cutoff in cutoffs:
+                compute_data = {}
+                for d in varnames:
+                    if d in unused:
+                        compute_data[d] = None
+                    elif 'Minute' in d:
+                        cube, minutes = cubes[d]
+                        cube = cube[:, :sum([m <= cutoff for m in minutes])]
+                        compute_data[d] = cube.copy() if len(cutoffs) > 1 else cube
+                    else:
+                        compute_data[d] = daily_data[d].reindex(index=chunk_index, columns=stocks).values
+
+                with stage('minute'):
+                    res = self.minute_batch(*[compute_data[var] for var in varnames])
+                factors[cutoff].append(pd.DataFrame(to_precision(np.asarray(res)), index=chunk_index, columns=stocks))
+
+        factors = {cutoff: pd.concat(factors[cutoff]) for cutoff in cutoffs}
 
         return factors
 
 
+    def read_minute(self, field, date):
+        '''load one day of minute data, field is a parameter name like MinuteClose'''
+        return to_precision(read_minute(self.minute_data_map_[field], date))
+
+
+    def expression_data(self, field):
+        '''daily data of field as fed to expression, shifted like definition. operators never modify their
+        inputs, so no copy is made
+        '''
+        assert 'Minute' not in field, 'expression only supports daily fields!!!'
+        if field == 'adjfactor':
+            return to_precision(self.adj_)
+        if self.fac_type_ == 'KFC':
+            return to_precision(load_daily(field).loc[self.start_date_pre_:])
+
+        return to_precision(load_daily(field).shift(1).loc[self.start_date_pre_:])
+
+
     def calculate(self):
+        if type(self).expression is not AlphaFactorX.expression:
+            outputs = {'value': self.expression()}
+            with stage('daily_load'):
+                data = {d: self.expression_data(d) for d in fields(outputs)}
+            with stage('definition'):
+                result = evaluate(outputs, data.pop)['value']
+            return to_precision(result.loc[self.start_date_:])
+
         varnames, unused = self.get_vars_unused(self.definition)
 
         compute_data = {}
-        for d in varnames:
-            if (d in unused) or ('Minute' in d):
-                compute_data[d] = None
-                continue
+        with stage('daily_load'):
+            for d in varnames:
+                if (d in unused) or ('Minute' in d):
+                    compute_data[d] = None
+                    continue
 
-            if d == 'adjfactor':
-                compute_data[d] = self.adj_
-                continue
+                if d == 'adjfactor':
+                    compute_data[d] = to_precision(self.adj_)
+                    continue
 
-            if self.fac_type_ == 'KFC':
-                compute_data[d] = pd.read_pickle(self.daily_data_path_+d+'.pkl').loc[self.start_date_pre_:]
-            else:
-                compute_data[d] = pd.read_pickle(self.daily_data_path_+d+'.pkl').shift(1).loc[self.start_date_pre_:]
+                if self.fac_type_ == 'KFC':
+                    # cached panels are shared, factor code gets a copy
+                    data = load_daily(d).loc[self.start_date_pre_:]
+                    compute_data[d] = to_precision(data) if float_dtype() != np.float64 else data.copy()
+                else:
+                    compute_data[d] = to_precision(load_daily(d).shift(1).loc[self.start_date_pre_:])
         
-        result = self.definition(*[compute_data[var] for var in varnames])
+        with stage('definition'):
+            result = self.definition(*[compute_data[var] for var in varnames])
+
+        return to_precision(result.loc[self.start_date_:])
+
+
+    def calculate_sweep(self, cutoffs):
+        '''calculate with each of cutoffs as the last minute of minute data, e.g. ['0944', '0959'].
+        minute data is read once for all cutoffs.
+        Returns:
+            dict of cutoff to pandas.DataFrame, factor values
+        '''
+        assert self.fac_type_ != 'KFC', 'cutoffs only apply to minute factors!!!'
+        default = self.hf_map_[self.fac_type_]
+        self.cutoffs_, self.sweep_ = list(cutoffs), {}
+        results = {}
+        try:
+            for cutoff in cutoffs:
+                self.hf_map_[self.fac_type_] = cutoff
+                results[cutoff] = self.calculate()
+        finally:
+            self.hf_map_[self.fac_type_] = default
+            self.cutoffs_, self.sweep_ = [], {}
 
-        return result.loc[self.start_date_:]
+        return results
 
 
     def set_param(self):
@@ -149,7 +373,46 @@ class AlphaFactorX(object):
     def definition(self):
         raise NotImplementedError
 
+
+    def expression(self):
+        '''optional, instead of definition: an Expr of framework/expr.py over daily fields'''
+        raise NotImplementedError
+
             
     def minute(self):
         raise NotImplementedError
 
+
+    def minute_batch(self):
+        raise NotImplementedError
+
+
+def calculate_expressions(objs):
+    '''values of factors defined by expression, from one pass over their merged graph per group of factors with
+    the same type and dates, so subexpressions shared by factors are evaluated once.
+    Params:
+        objs: list of AlphaFactorX, instances of factors defining expression
+
+    Returns:
+        dict of factor name to pandas.DataFrame, factor values
+    '''
+    groups = {}
+    for obj in objs:
+        groups.setdefault((obj.fac_type_, obj.start_date_pre_, obj.start_date_), []).append(obj)
+
+    results = {}
+    for group in groups.values():
+        outputs = {type(obj).__name__: obj.expression() for obj in group}
+        with stage('definition'):
+            values = evaluate(outputs, group[0].expression_data)
+        for name in list(values):
+            results[name] = to_precision(values.pop(name).loc[group[0].start_date_:])
+
+    return results
+
+
+_minute_job = None
+
+def _minute_range_job(lo, hi):
+    obj, varnames, unused, daily_data, cutoffs = _minute_job
+    return obj.minute_range(lo, hi, varnames, unused, daily_data, cutoffs)
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+
+# factor expressions: a factor defines expression() returning a graph of operators of framework/ops.py over daily
+# fields instead of computing them in definition(). graphs of many factors are merged by structure, so an
+# intermediate shared by factors of a batch, e.g. ts_mean(field('close') * field('adjfactor'), 20), is evaluated
+# once, and dropped as soon as nothing left to evaluate refers to it.
+
+import inspect
+
+import numpy as np
+
+from framework import ops
+
+
+def _arg_key(v):
+    if isinstance(v, Expr):
+        return v.key_
+    if isinstance(v, (int, float, str, bool, type(None), np.number)):
+        return ('const', repr(v))
+    return ('object', id(v)) # panels passed as is, e.g. exposures of cs_neutralize
+
+
+class Expr(object):
+    '''Node of a factor expression: operator op applied to args, each an Expr or a constant.
+    Nodes with the same op and args are the same node of a merged graph, see key_.
+    Params:
+        op: str, name of an operator in _operators, or 'field' for a daily field
+        args: tuple of (name, value) pairs, arguments of the operator by name
+
+    Returns:
+        Expr, combined with +, -, *, /, ** and the operators of this module into larger expressions.
+    '''
+    def __init__(self, op, args):
+        self.op_ = op
+        self.args_ = tuple(args)
+        self.key_ = (op, tuple([(k, _arg_key(v)) for k, v in self.args_]))
+
+
+    def children(self):
+        return [v for _, v in self.args_ if isinstance(v, Expr)]
+
+
+    def __repr__(self):
+        if self.op_ == 'field':
+            return f'field({self.args_[0][1]!r})'
+        return f'{self.op_}({", ".join([repr(v) for _, v in self.args_])})'
+
+
+    def __add__(self, other):
+        return _apply('add', self, other)
+
+
+    def __radd__(self, other):
+        return _apply('add', other, self)
+
+
+    def __sub__(self, other):
+        return _apply('sub', self, other)
+
+
+    def __rsub__(self, other):
+        return _apply('sub', other, self)
+
+
+    def __mul__(self, other):
+        return _apply('mul', self, other)
+
+
+    def __rmul__(self, other):
+        return _apply('mul', other, self)
+
+
+    def __truediv__(self, other):
+        return _apply('div', self, other)
+
+
+    def __rtruediv__(self, other):
+        return _apply('div', other, self)
+
+
+    def __pow__(self, other):
+        return _apply('pow', self, other)
+
+
+    def __neg__(self):
+        return _apply('neg', self)
+
+
+    def __abs__(self):
+        return _apply('abs', self)
+
+
+def _elementwise(func):
+    def op(*args):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return func(*args)
+    return op
+
+
+_operators = {
+    'add': _elementwise(lambda x, y: x + y),
+    'sub': _elementwise(lambda x, y: x - y),
+    'mul': _elementwise(lambda x, y: x * y),
+    'div': _elementwise(lambda x, y: x / y),
+    'pow': _elementwise(lambda x, y: x ** y),
+    'neg': _elementwise(lambda x: -x),
+    'abs': _elementwise(np.abs),
+    'log': _elementwise(np.log),
+    'sign': _elementwise(np.sign),
+}
+_operators.update({name: getattr(ops, name) for name in [
+    'delay', 'delta', 'ts_sum', 'ts_mean', 'ts_var', 'ts_std', 'ts_cov', 'ts_corr', 'ts_min', 'ts_max', 'ts_rank',
+    'decay_linear', 'cs_rank', 'cs_zscore', 'cs_neutralize',
+]})
+
+
+def _apply(op, *args, **kwargs):
+    '''Expr of op, args bound to the parameter names of the operator with defaults filled, so that
+    ts_mean(x, 20) and ts_mean(x, d=20) are the same node
+    '''
+    sig = inspect.signature(_operators[op])
+    bound = sig.bind(*args, **kwargs)
+    bound.apply_defaults()
+    items = []
+    for k, v in bound.arguments.items():
+        if sig.parameters[k].kind == inspect.Parameter.VAR_POSITIONAL:
+            items += [(f'{k}{i}', a) for i, a in enumerate(v)]
+        else:
+            items.append((k, v))
+
+    return Expr(op, items)
+
+
+def field(name):
+    '''daily field name, e.g. field('close'), as fed to definition'''
+    return Expr('field', [('name', name)])
+
+
+def _make_operator(op):
+    def f(*args, **kwargs):
+        return _apply(op, *args, **kwargs)
+    f.__name__ = op
+    f.__doc__ = f'expression of {op}, see framework/ops.py' if hasattr(ops, op) else f'expression of np.{op}'
+    return f
+
+
+abs = _make_operator('abs')
+log = _make_operator('log')
+sign = _make_operator('sign')
+delay = _make_operator('delay')
+delta = _make_operator('delta')
+ts_sum = _make_operator('ts_sum')
+ts_mean = _make_operator('ts_mean')
+ts_var = _make_operator('ts_var')
+ts_std = _make_operator('ts_std')
+ts_cov = _make_operator('ts_cov')
+ts_corr = _make_operator('ts_corr')
+ts_min = _make_operator('ts_min')
+ts_max = _make_operator('ts_max')
+ts_rank = _make_operator('ts_rank')
+decay_linear = _make_operator('decay_linear')
+cs_rank = _make_operator('cs_rank')
+cs_zscore = _make_operator('cs_zscore')
+cs_neutralize = _make_operator('cs_neutralize')
+
+
+def plan(outputs):
+    '''evaluation order of the merged graph of outputs, each node once, and reference counts of nodes.
+    Params:
+        outputs: dict of name to Expr
+
+    Returns:
+        tuple of (list of unique Expr in dependency order, dict of key to number of references)
+    '''
+    order, seen, refs = [], set(), {}
+    for e in outputs.values():
+        refs[e.key_] = refs.get(e.key_, 0) + 1
+        stack = [(e, False)]
+        while len(stack) > 0:
+            node, expanded = stack.pop()
+            if node.key_ in seen:
+                continue
+            if expanded:
+                seen.add(node.key_)
+                order.append(node)
+                for c in node.children():
+                    refs[c.key_] = refs.get(c.key_, 0) + 1
+                continue
+            stack.append((node, True))
+            stack += [(c, False) for c in reversed(node.children()) if c.key_ not in seen]
+
+    return order, refs
+
+
+def fields(outputs):
+    '''daily fields read by outputs, dict of name to Expr'''
+    order, _ = plan(outputs)
+    return sorted(set([e.args_[0][1] for e in order if e.op_ == 'field']))
+
+
+def evaluate(outputs, load):
+    '''values of outputs from one pass over their merged graph, every node evaluated once and freed once no
+    node left to evaluate refers to it.
+    Params:
+        outputs: dict of name to Expr
+        load: callable, daily field name to its panel
+
+    Returns:
+        dict of name to value of its expression
+    '''
+    order, refs = plan(outputs)
+    values = {}
+    for node in order:
+        if node.op_ == 'field':
+            values[node.key_] = load(node.args_[0][1])
+        else:
+            args = [values[v.key_] if isinstance(v, Expr) else v for _, v in node.args_]
+            values[node.key_] = _operators[node.op_](*args)
+        for c in node.children():
+            refs[c.key_] -= 1
+            if refs[c.key_] == 0:
+                del values[c.key_]
+
+    return {name: values[e.key_] for name, e in outputs.items()}
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+
+# consolidated factor library store: factors of one family (KD, KH, KJ, KL, KFC) share memory-mapped float32 blocks,
+# one block per year laid out as (factors x dates x stocks), so adding a factor appends bytes to the block and a
+# factor over a date range inside a year is a zero-copy view.
+
+import os
+import json
+import fcntl
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from framework.config import conf
+from framework.cache import load_daily
+
+
+def factor_family(factor_name):
+    hfs = ['KD', 'KH', 'KJ', 'KL']
+    if not any([factor_name.startswith(i) for i in hfs]):
+        return 'KFC'
+
+    return factor_name.split('_')[0]
+
+
+class FactorStore(object):
+    '''Chunked on-disk store of factor values.
+    Layout under root: <family>/<year>.f32 holds the raw block, <family>/<year>.json holds dates, stocks and factors.
+    Dates of a year block follow the trading calendar of adjfactor, rows and columns are allocated with headroom
+    so new dates and new stocks fill spare rows and columns in place.
+    Params:
+        root: str, dir of the store, default conf['factor_store_dir']
+
+    Returns:
+        FactorStore, use write() to append or update factors and read() to get them.
+    '''
+    def __init__(self, root=None):
+        self.root_ = conf.get('factor_store_dir', '') if root is None else root
+        self.day_cap_ = 262
+        self.stock_spare_ = 512
+
+
+    def chunk_files(self, family, year):
+        return self.root_+family+'/'+str(year)+'.json', self.root_+family+'/'+str(year)+'.f32'
+
+
+    def load_meta(self, family, year):
+        meta_file, _ = self.chunk_files(family, year)
+        if not os.path.exists(meta_file):
+            return None
+        with open(meta_file, 'r') as f:
+            return json.load(f)
+
+
+    def save_meta(self, family, year, meta):
+        meta_file, _ = self.chunk_files(family, year)
+        with open(meta_file+'.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(meta_file+'.tmp', meta_file)
+
+
+    def open_chunk(self, family, year, meta, mode='r'):
+        _, data_file = self.chunk_files(family, year)
+        shape = (len(meta['factors']), meta['day_cap'], meta['stock_cap'])
+        if shape[0] == 0:
+            return np.full(shape, np.nan, dtype=np.float32)
+
+        return np.memmap(data_file, dtype=np.float32, mode=mode, shape=shape)
+
+
+    @contextmanager
+    def lock(self, family):
+        '''serialize writers of a family, e.g. workers of main_mp'''
+        os.makedirs(self.root_+family, exist_ok=True)
+        with open(self.root_+family+'/.lock', 'w') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+    def years(self, family):
+        '''years of the blocks of a family'''
+        if not os.path.isdir(self.root_+family):
+            return []
+
+        return sorted([int(fn[:-5]) for fn in os.listdir(self.root_+family) if fn.endswith('.json')])
+
+
+    def factors(self, family):
+        '''names of factors of a family in the store'''
+        names = []
+        for year in self.years(family):
+            names.extend([f for f in self.load_meta(family, year)['factors'] if f not in names])
+
+        return names
+
+
+    def write(self, factor_name, factor_df):
+        '''append factor_name to the store or update its values on the dates of factor_df'''
+        family = factor_family(factor_name)
+        with self.lock(family):
+            for year, df in factor_df.groupby(factor_df.index.year):
+                self.write_chunk(family, year, factor_name, df)
+
+
+    def write_chunk(self, family, year, factor_name, df):
+        meta = self.load_meta(family, year)
+        if meta is None:
+            calendar = load_daily('adjfactor').index
+            calendar = calendar[calendar.year == year].strftime(r'%Y%m%d').tolist()
+            stocks = load_daily('adjfactor').columns.tolist()
+            meta = {'dates': calendar, 'stocks': stocks, 'factors': [],
+                    'day_cap': max(self.day_cap_, len(calendar)), 'stock_cap': len(stocks)+self.stock_spare_}
+            _, data_file = self.chunk_files(family, year)
+            open(data_file, 'wb').close()
+
+        dates = df.index.strftime(r'%Y%m%d')
+        new_dates = sorted(set(dates).difference(meta['dates']))
+        assert (len(new_dates) == 0) or (len(meta['dates']) == 0) or (new_dates[0] > meta['dates'][-1]), \
+            'only dates after the last stored date of a year can be added!!!'
+        new_stocks = [s for s in df.columns if s not in set(meta['stocks'])]
+        if (len(meta['dates'])+len(new_dates) > meta['day_cap']) or (len(meta['stocks'])+len(new_stocks) > meta['stock_cap']):
+            meta = self.resize_chunk(family, year, meta, len(meta['dates'])+len(new_dates), len(meta['stocks'])+len(new_stocks))
+        meta['dates'] = meta['dates'] + new_dates
+        meta['stocks'] = meta['stocks'] + new_stocks
+
+        if factor_name not in meta['factors']:
+            # a new factor is a new block at the end of the file, filled with NaN
+            _, data_file = self.chunk_files(family, year)
+            block = (meta['day_cap'], meta['stock_cap'])
+            with open(data_file, 'ab') as f:
+                np.full(block, np.nan, dtype=np.float32).tofile(f)
+            meta['factors'] = meta['factors'] + [factor_name]
+
+        arr = self.open_chunk(family, year, meta, mode='r+')
+        rows = pd.Index(meta['dates']).get_indexer(dates)
+        cols = pd.Index(meta['stocks']).get_indexer(df.columns)
+        arr[meta['factors'].index(factor_name)][np.ix_(rows, cols)] = df.values.astype(np.float32)
+        arr.flush()
+        del arr
+
+        self.save_meta(family, year, meta)
+
+
+    def resize_chunk(self, family, year, meta, n_dates, n_stocks):
+        '''rewrite a block with more spare rows and columns'''
+        old = self.open_chunk(family, year, meta)
+        new_meta = dict(meta)
+        new_meta['day_cap'] = max(meta['day_cap'], n_dates)
+        new_meta['stock_cap'] = max(meta['stock_cap'], n_stocks+self.stock_spare_)
+
+        _, data_file = self.chunk_files(family, year)
+        with open(data_file+'.tmp', 'wb') as f:
+            for i in range(len(meta['factors'])):
+                block = np.full((new_meta['day_cap'], new_meta['stock_cap']), np.nan, dtype=np.float32)
+                block[:meta['day_cap'], :meta['stock_cap']] = old[i]
+                block.tofile(f)
+        del old
+        os.replace(data_file+'.tmp', data_file)
+        self.save_meta(family, year, new_meta)
+
+        return new_meta
+
+
+    def read(self, factor_name, start=None, end=None):
+        '''values of factor_name between start and end (both included), a view of the store within one year'''
+        family = factor_family(factor_name)
+        start = '00000000' if start is None else pd.Timestamp(start).strftime(r'%Y%m%d')
+        end = '99999999' if end is None else pd.Timestamp(end).strftime(r'%Y%m%d')
+
+        frames = []
+        for year in self.years(family):
+            if (str(year) < start[:4]) or (str(year) > end[:4]):
+                continue
+            meta = self.load_meta(family, year)
+            if (meta is None) or (factor_name not in meta['factors']):
+                continue
+            dates = pd.Index(meta['dates'])
+            d0, d1 = dates.searchsorted(start, side='left'), dates.searchsorted(end, side='right')
+            if d1 <= d0:
+                continue
+            arr = self.open_chunk(family, year, meta, mode='c')
+            values = arr[meta['factors'].index(factor_name), d0:d1, :len(meta['stocks'])]
+            frames.append(pd.DataFrame(values, index=pd.to_datetime(dates[d0:d1]), columns=meta['stocks'], copy=False))
+
+        if len(frames) == 0:
+            raise KeyError(f'{factor_name} not found in factor store {self.root_}')
+        if len(frames) == 1:
+            return frames[0]
+
+        return pd.concat(frames)
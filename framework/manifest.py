@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+# manifest of factor modules from their syntax trees: args of definition, minute and minute_batch, args not used
+# by them, daily fields of expression, params and fields to load, known without importing the modules. kept under
+# cache_dir if configured, only modules changed since are parsed again.
+
+import os
+import ast
+import json
+import hashlib
+
+from framework.config import conf
+from framework.factor_store import factor_family
+
+
+_functions = ['definition', 'minute', 'minute_batch', 'expression']
+
+
+def parse_classes(source):
+    '''manifest entries of classes defining any of definition, minute, minute_batch and expression in source'''
+    classes = {}
+    for node in ast.parse(source).body:
+        if not isinstance(node, ast.ClassDef):
+            continue
+        methods = {f.name: f for f in node.body if isinstance(f, (ast.FunctionDef, ast.AsyncFunctionDef))}
+        if not any([f in methods for f in _functions]):
+            continue
+
+        functions = {}
+        for name in _functions:
+            if name not in methods:
+                continue
+            func = methods[name]
+            if name == 'expression':
+                # fields of field('...') calls are its args
+                calls = [n for n in ast.walk(func) if isinstance(n, ast.Call) and (len(n.args) > 0)
+                         and (getattr(n.func, 'id', None) == 'field' or getattr(n.func, 'attr', None) == 'field')]
+                args = sorted(set([c.args[0].value for c in calls if isinstance(c.args[0], ast.Constant)]))
+                functions[name] = {'args': args, 'unused': []}
+                continue
+            args = [a.arg for a in func.args.args[1:]] # exclude self
+            names = set([n.id for stmt in func.body for n in ast.walk(stmt) if isinstance(n, ast.Name)])
+            functions[name] = {'args': args, 'unused': [a for a in args if a not in names]}
+
+        params = None
+        if 'set_param' in methods:
+            returns = [n for n in ast.walk(methods['set_param']) if isinstance(n, ast.Return)]
+            assigns = {t.id: n.value for n in ast.walk(methods['set_param']) if isinstance(n, ast.Assign)
+                       for t in n.targets if isinstance(t, ast.Name)}
+            if len(returns) == 1:
+                value = returns[0].value
+                value = assigns.get(value.id, value) if isinstance(value, ast.Name) else value
+                try:
+                    params = ast.literal_eval(value)
+                except (ValueError, TypeError):
+                    params = None # not a literal, set_param has to be called
+
+        used = [a for f in functions.values() for a in f['args'] if a not in f['unused']]
+        classes[node.name] = {
+            'type': factor_family(node.name),
+            'params': params,
+            'functions': functions,
+            'daily_fields': sorted(set([a for a in used if 'Minute' not in a])),
+            'minute_fields': sorted(set([a for a in used if 'Minute' in a])),
+            # same rule as the line check of check_prediction: minute data in the args of definition
+            'minute_flag': any(['Minute' in a for a in functions.get('definition', {'args': []})['args']]),
+        }
+
+    return classes
+
+
+_manifests = {}
+
+def file_manifest(path):
+    '''manifest of the classes in a python file, parsed again only if the file changed'''
+    st = os.stat(path)
+    item = _manifests.get(path)
+    if (item is None) or (item['mtime'] != st.st_mtime) or (item['size'] != st.st_size):
+        with open(path, 'rb') as f:
+            source = f.read()
+        item = {'mtime': st.st_mtime, 'size': st.st_size, 'sha1': hashlib.sha1(source).hexdigest(),
+                'classes': parse_classes(source)}
+        _manifests[path] = item
+
+    return item
+
+
+def script_dir():
+    prj_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return prj_path+'/'+conf.get('factor_script_dir', 'factor_script')+'/'
+
+
+def factor_entry(factor_name):
+    '''manifest entry of a factor under factor_script_dir, with sha1 of its module. KeyError if not found'''
+    path = script_dir()+factor_name+'.py'
+    if not os.path.exists(path):
+        raise KeyError(factor_name)
+    item = file_manifest(path)
+
+    return dict(item['classes'][factor_name], sha1=item['sha1'])
+
+
+def scan_factors():
+    '''manifest of all factor modules under factor_script_dir, kept under cache_dir if configured.
+    Returns:
+        dict of factor name to its entry, e.g. {'KH_Demo': {'type': 'KH', 'params': {...}, 'functions': {...},
+        'daily_fields': [...], 'minute_fields': ['MinuteHigh', 'MinuteLow'], 'minute_flag': True, 'sha1': ...}}
+    '''
+    cache_file = conf.get('cache_dir', '')+'manifest.json'
+    if conf.get('cache_dir', '') and os.path.exists(cache_file):
+        with open(cache_file, 'r') as f:
+            for path, item in json.load(f).items():
+                _manifests.setdefault(path, item)
+
+    versions = {p: (item['mtime'], item['size']) for p, item in _manifests.items()}
+    manifest = {}
+    for fn in sorted(os.listdir(script_dir())):
+        if (not fn.endswith('.py')) or fn.startswith('_'):
+            continue
+        try:
+            manifest[fn[:-3]] = factor_entry(fn[:-3])
+        except (KeyError, SyntaxError):
+            continue # not a factor module
+
+    changed = any([versions.get(p) != (item['mtime'], item['size']) for p, item in _manifests.items()])
+    if conf.get('cache_dir', '') and changed:
+        os.makedirs(conf.get('cache_dir', ''), exist_ok=True)
+        with open(cache_file+'.tmp', 'w') as f:
+            json.dump(_manifests, f)
+        os.replace(cache_file+'.tmp', cache_file)
+
+    return manifest
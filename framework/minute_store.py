@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+
+# columnar minute data store: each minute field lives in a single (days x minutes x stocks) float32 file
+# opened with np.memmap, so a day or a minute slice is a view instead of a full unpickling.
+
+import os
+import json
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from framework.config import conf
+
+
+class MinuteStore(object):
+    '''Memory-mapped minute data store.
+    Layout under root: <Field>.f32 holds the raw array, <Field>.json holds dates, minutes and stocks.
+    Each day has spare stock columns (stock_cap in meta), so stocks listed later are appended in place.
+    Params:
+        root: str, dir of the store
+
+    Returns:
+        MinuteStore, use day() to get a day of minute data as pandas.DataFrame.
+    '''
+    def __init__(self, root):
+        self.root_ = root
+        self.meta_ = {}
+        self.arrays_ = {}
+
+
+    def has(self, field, date=None):
+        if field not in self.meta_:
+            if not os.path.exists(self.root_+field+'.json'):
+                return False
+            self.load(field)
+        return (date is None) or (date in self.meta_[field]['date_loc'])
+
+
+    def load(self, field):
+        with open(self.root_+field+'.json', 'r') as f:
+            meta = json.load(f)
+        shape = (len(meta['dates']), len(meta['minutes']), meta.get('stock_cap', len(meta['stocks'])))
+        # copy-on-write, so in-place edits in factor code never touch the file
+        arr = np.memmap(self.root_+field+'.f32', dtype=np.float32, mode='c', shape=shape)
+        self.arrays_[field] = arr[:, :, :len(meta['stocks'])]
+        meta['date_loc'] = {d: i for i, d in enumerate(meta['dates'])}
+        meta['offsets'] = pd.to_timedelta([f'{m[:2]}:{m[2:]}:00' for m in meta['minutes']])
+        meta['columns'] = pd.Index(meta['stocks'])
+        self.meta_[field] = meta
+
+
+    def day(self, field, date):
+        '''one day of minute data, a zero-copy view wrapped in pandas.DataFrame'''
+        meta = self.meta_[field]
+        values = self.arrays_[field][meta['date_loc'][date]]
+        index = pd.Timestamp(date) + meta['offsets']
+
+        return pd.DataFrame(values, index=index, columns=meta['columns'], copy=False)
+
+
+_stores = {}
+
+def get_store(root=None):
+    '''shared MinuteStore for root, default conf['minute_store_path']; None if not configured'''
+    root = conf.get('minute_store_path', '') if root is None else root
+    if not root:
+        return None
+    if root not in _stores:
+        _stores[root] = MinuteStore(root)
+
+    return _stores[root]
+
+
+def read_minute(field, date):
+    '''one day of minute data of field (e.g. Amount, Close), from the store when available, else from pickle'''
+    store = get_store()
+    if (store is not None) and store.has(field, date):
+        return store.day(field, date)
+
+    return pd.read_pickle(conf.get('minute_data_path', '')+field+'/'+date+'.pkl')
+
+
+def minute_mtimes(field, dates):
+    '''mtimes of the minute pickles of field on dates, None for missing ones'''
+    path = conf.get('minute_data_path', '')+field+'/'
+    mtimes = []
+    for date in dates:
+        try:
+            mtimes.append(os.stat(path+date+'.pkl').st_mtime)
+        except OSError:
+            mtimes.append(None)
+
+    return mtimes
+
+
+def minute_digest(fields, dates):
+    '''digest of the mtimes of the minute pickles of fields on dates, changed once any of them is rewritten.
+    mtimes of the dirs would miss a pickle rewritten in place.
+    '''
+    sha = hashlib.sha1()
+    for field in fields:
+        sha.update(json.dumps([field, minute_mtimes(field, dates)]).encode())
+
+    return sha.hexdigest()
+
+
+_stock_spare = 512
+
+def build_minute_store(field, dates, root=None, stocks=None):
+    '''convert per-day minute pickles of field into the store, appending dates not yet converted.
+    stocks in a pickle but not in the store yet, e.g. new listings, are added to the stock axis.
+    Params:
+        field: str, minute field dir name, e.g. Amount, Close
+        dates: list of str, dates as YYYYMMDD
+        root: str, dir of the store, default conf['minute_store_path']
+        stocks: list of str, initial stock universe of a new store, default columns of adjfactor.pkl
+
+    Returns:
+        int, number of dates appended
+    '''
+    root = conf.get('minute_store_path', '') if root is None else root
+    minute_path = conf.get('minute_data_path', '')
+    meta_file = root+field+'.json'
+    data_file = root+field+'.f32'
+
+    if os.path.exists(meta_file):
+        with open(meta_file, 'r') as f:
+            meta = json.load(f)
+        meta['stock_cap'] = meta.get('stock_cap', len(meta['stocks']))
+    else:
+        if stocks is None:
+            stocks = pd.read_pickle(conf.get('daily_data_path', '')+'adjfactor.pkl').columns
+        first = pd.read_pickle(minute_path+field+'/'+dates[0]+'.pkl')
+        meta = {'dates': [], 'minutes': first.index.strftime(r'%H%M').tolist(), 'stocks': list(stocks),
+                'stock_cap': len(stocks)+_stock_spare}
+        open(data_file, 'wb').close()
+
+    new_dates = sorted(set(dates).difference(meta['dates']))
+    if len(meta['dates']) > 0:
+        assert (len(new_dates) == 0) or (new_dates[0] > meta['dates'][-1]), 'only dates after the last stored date can be appended!!!'
+    if len(new_dates) == 0:
+        return 0
+
+    n_min = len(meta['minutes'])
+    minutes = pd.Index(meta['minutes'])
+    with open(data_file, 'r+b') as f:
+        f.truncate(len(meta['dates'])*n_min*meta['stock_cap']*4) # drop a partial day left by an interrupted run
+
+    for date in new_dates:
+        tmp = pd.read_pickle(minute_path+field+'/'+date+'.pkl')
+        tmp.index = tmp.index.strftime(r'%H%M')
+        known = set(meta['stocks'])
+        new_stocks = [s for s in tmp.columns if s not in known]
+        if len(meta['stocks'])+len(new_stocks) > meta['stock_cap']:
+            meta = _resize_minute_store(data_file, meta, len(meta['stocks'])+len(new_stocks)+_stock_spare)
+            with open(meta_file, 'w') as f:
+                json.dump(meta, f) # the file was rewritten with the new stock_cap
+        meta['stocks'] = meta['stocks'] + new_stocks
+
+        day = np.full((n_min, meta['stock_cap']), np.nan, dtype=np.float32)
+        day[:, :len(meta['stocks'])] = tmp.reindex(index=minutes, columns=meta['stocks']).values
+        # days are the outermost axis, so appending a day is appending bytes at the end of the file
+        with open(data_file, 'ab') as f:
+            day.tofile(f)
+        meta['dates'] = meta['dates'] + [date]
+
+    with open(meta_file, 'w') as f:
+        json.dump(meta, f)
+
+    _stores.pop(root, None)
+
+    return len(new_dates)
+
+
+def _resize_minute_store(data_file, meta, stock_cap):
+    '''rewrite the store with more spare stock columns'''
+    n_min, old_cap = len(meta['minutes']), meta['stock_cap']
+    with open(data_file+'.tmp', 'wb') as f:
+        if len(meta['dates']) > 0:
+            old = np.memmap(data_file, dtype=np.float32, mode='r', shape=(len(meta['dates']), n_min, old_cap))
+            for i in range(len(meta['dates'])):
+                day = np.full((n_min, stock_cap), np.nan, dtype=np.float32)
+                day[:, :old_cap] = old[i]
+                day.tofile(f)
+            del old
+    os.replace(data_file+'.tmp', data_file)
+
+    return dict(meta, stock_cap=stock_cap)
+
+
+def read_minute_cube(field, dates, stocks, cutoff='1500'):
+    '''minute data of field on dates as one (days x minutes x stocks) array, minutes up to cutoff (HHMM) included.
+    Params:
+        field: str, minute field dir name, e.g. Amount, Close
+        dates: list of str, dates as YYYYMMDD
+        stocks: pandas.Index, stocks of the last axis, missing ones filled with NaN
+        cutoff: str, last minute included, e.g. '0959'
+
+    Returns:
+        tuple of (numpy.ndarray, list of minutes as HHMM)
+    '''
+    store = get_store()
+    if (store is not None) and all([store.has(field, date) for date in dates]):
+        meta = store.meta_[field]
+        n_min = sum([m <= cutoff for m in meta['minutes']])
+        locs = [meta['date_loc'][date] for date in dates]
+        if locs == list(range(locs[0], locs[0]+len(locs))):
+            cube = store.arrays_[field][locs[0]:locs[0]+len(locs), :n_min] # a view for contiguous dates
+        else:
+            cube = store.arrays_[field][locs, :n_min]
+        if not meta['columns'].equals(stocks):
+            indexer = meta['columns'].get_indexer(stocks)
+            cube = np.take(cube, indexer, axis=2)
+            cube[:, :, indexer < 0] = np.nan
+        return cube, meta['minutes'][:n_min]
+
+    frames = []
+    for date in dates:
+        tmp = read_minute(field, date).loc[:date+cutoff]
+        tmp.index = tmp.index.strftime(r'%H%M')
+        frames.append(tmp)
+    minutes = frames[0].index
+    cube = np.stack([tmp.reindex(index=minutes, columns=stocks).values for tmp in frames])
+
+    return cube, minutes.tolist()
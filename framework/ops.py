@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+
+# operators for factor definitions over dates x stocks panels (pandas.DataFrame or numpy.ndarray, returned alike).
+# time-series operators run along dates in O(n) per stock: windows are split into blocks of the window length,
+# a window is the suffix of one block plus the prefix of the next (van Herk / Gil-Werman), so sums are exact to
+# rounding over at most two blocks and min / max need no sorting. NaN are skipped, a window with fewer valid values
+# than min_periods (default the whole window, as pandas rolling) gives NaN.
+
+import numpy as np
+import pandas as pd
+
+
+def _values(x):
+    return np.asarray(x.values if isinstance(x, (pd.DataFrame, pd.Series)) else x, dtype=np.float64)
+
+
+def _wrap(values, like):
+    '''values in the type of like, float32 kept as float32'''
+    if getattr(like, 'dtype', None) == np.float32 or (isinstance(like, pd.DataFrame) and all([t == np.float32 for t in like.dtypes])):
+        values = values.astype(np.float32)
+    if isinstance(like, pd.DataFrame):
+        return pd.DataFrame(values, index=like.index, columns=like.columns)
+    if isinstance(like, pd.Series):
+        return pd.Series(values, index=like.index, name=like.name)
+
+    return values
+
+
+def _check_window(d, min_periods):
+    assert isinstance(d, (int, np.integer)) and d > 0, 'window should be a positive integer!!!'
+    min_periods = d if min_periods is None else min_periods
+    assert 0 < min_periods <= d, 'min_periods should be in [1, window]!!!'
+
+    return min_periods
+
+
+def window_reduce(values, d, ufunc, identity):
+    '''ufunc (np.add, np.minimum or np.maximum) reduced over windows of the last d rows, in O(n).
+    rows before the d-th are reduced over the rows so far.
+    Params:
+        values: numpy.ndarray, dates x ... array, no NaN (fill them with identity first)
+        d: int, window length
+        ufunc: numpy.ufunc, associative
+        identity: float, identity of ufunc, e.g. 0 for np.add
+
+    Returns:
+        numpy.ndarray, same shape as values
+    '''
+    n = len(values)
+    nb = -(-n // d)
+    if nb*d > n:
+        values = np.concatenate([values, np.full((nb*d - n,) + values.shape[1:], identity)])
+    prefix = ufunc.accumulate(values.reshape((nb, d) + values.shape[1:]), axis=1)
+    suffix = ufunc.accumulate(values.reshape((nb, d) + values.shape[1:])[:, ::-1], axis=1)[:, ::-1]
+
+    # the window ending at position p < d-1 of block b+1 starts at position p+1 of block b, at p = d-1 it is the
+    # whole block b+1, which is its prefix already
+    ufunc(suffix[:-1, 1:], prefix[1:, :-1], out=prefix[1:, :-1])
+
+    return prefix.reshape((nb*d,) + values.shape[1:])[:n]
+
+
+def _sums(d, min_periods, *arrays):
+    '''window sums of arrays over rows where all of them are valid, and counts of valid rows.
+    sums are NaN where counts are below min_periods.
+    '''
+    valid = ~np.isnan(arrays[0])
+    for a in arrays[1:]:
+        valid &= ~np.isnan(a)
+    count = window_reduce(valid.astype(np.float64), d, np.add, 0.)
+    sums = [window_reduce(np.where(valid, a, 0.), d, np.add, 0.) for a in arrays]
+    enough = count >= min_periods
+    for s in sums:
+        s[~enough] = np.nan
+
+    return sums, count, valid
+
+
+def delay(x, d=1):
+    '''value d dates ago'''
+    values = _values(x)
+    out = np.full(values.shape, np.nan)
+    if d < len(values):
+        out[d:] = values[:len(values)-d]
+
+    return _wrap(out, x)
+
+
+def delta(x, d=1):
+    '''change over d dates'''
+    values = _values(x)
+
+    return _wrap(values - _values(delay(values, d)), x)
+
+
+def ts_sum(x, d, min_periods=None):
+    '''sum over the last d dates'''
+    min_periods = _check_window(d, min_periods)
+    (s,), _, _ = _sums(d, min_periods, _values(x))
+
+    return _wrap(s, x)
+
+
+def ts_mean(x, d, min_periods=None):
+    '''mean over the last d dates'''
+    min_periods = _check_window(d, min_periods)
+    (s,), count, _ = _sums(d, min_periods, _values(x))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return _wrap(s / count, x)
+
+
+_tiny = 1e-12
+
+def _centered(values):
+    '''values minus the mean of each stock, so sums of squares lose less to cancellation'''
+    with np.errstate(invalid='ignore'):
+        center = np.nanmean(values, axis=0) if len(values) > 0 else 0.
+    return values - np.where(np.isnan(center), 0., center)
+
+
+def ts_cov(x, y, d, min_periods=None, ddof=1):
+    '''covariance of x and y over the last d dates where both are valid'''
+    min_periods = _check_window(d, min_periods)
+    a, b = _centered(_values(x)), _centered(_values(y))
+    (sa, sb, sab), count, _ = _sums(d, min_periods, a, b, a * b)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cov = (sab - sa * sb / count) / (count - ddof)
+    cov[count <= ddof] = np.nan
+
+    return _wrap(cov, x)
+
+
+def ts_var(x, d, min_periods=None, ddof=1):
+    '''variance over the last d dates'''
+    min_periods = _check_window(d, min_periods)
+    a = _centered(_values(x))
+    (sa, saa), count, _ = _sums(d, min_periods, a, a * a)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ss = saa - sa * sa / count
+        # relative to the sums of squares, smaller ones are rounding noise of constant windows
+        ss[ss <= _tiny * saa] = 0.
+        var = ss / (count - ddof)
+    var[count <= ddof] = np.nan
+
+    return _wrap(var, x)
+
+
+def ts_std(x, d, min_periods=None, ddof=1):
+    '''standard deviation over the last d dates'''
+    return _wrap(np.sqrt(_values(ts_var(x, d, min_periods, ddof))), x)
+
+
+def ts_corr(x, y, d, min_periods=None):
+    '''correlation of x and y over the last d dates where both are valid, NaN if either is constant'''
+    min_periods = _check_window(d, min_periods)
+    a, b = _centered(_values(x)), _centered(_values(y))
+    a[np.isnan(b)] = np.nan
+    b[np.isnan(a)] = np.nan
+    (sa, sb, sab, saa, sbb), count, _ = _sums(d, min_periods, a, b, a * b, a * a, b * b)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cov = sab - sa * sb / count
+        var_a = saa - sa * sa / count
+        var_b = sbb - sb * sb / count
+        var_a[var_a <= _tiny * saa] = np.nan
+        var_b[var_b <= _tiny * sbb] = np.nan
+        corr = np.clip(cov / np.sqrt(var_a * var_b), -1., 1.)
+    corr[count < 2] = np.nan
+
+    return _wrap(corr, x)
+
+
+def ts_min(x, d, min_periods=None):
+    '''minimum over the last d dates'''
+    min_periods = _check_window(d, min_periods)
+    values = _values(x)
+    valid = ~np.isnan(values)
+    out = window_reduce(np.where(valid, values, np.inf), d, np.minimum, np.inf)
+    out[window_reduce(valid.astype(np.float64), d, np.add, 0.) < min_periods] = np.nan
+
+    return _wrap(out, x)
+
+
+def ts_max(x, d, min_periods=None):
+    '''maximum over the last d dates'''
+    min_periods = _check_window(d, min_periods)
+    values = _values(x)
+    valid = ~np.isnan(values)
+    out = window_reduce(np.where(valid, values, -np.inf), d, np.maximum, -np.inf)
+    out[window_reduce(valid.astype(np.float64), d, np.add, 0.) < min_periods] = np.nan
+
+    return _wrap(out, x)
+
+
+def ts_rank(x, d, min_periods=None):
+    '''percentile rank of the latest value among the last d dates, ties averaged, like rolling(d).rank(pct=True).
+    NaN if the latest value is NaN. O(n * d): the latest value is compared with each lag in turn.
+    '''
+    min_periods = _check_window(d, min_periods)
+    values = _values(x)
+    valid = ~np.isnan(values)
+    less = np.zeros(values.shape)
+    equal = np.zeros(values.shape)
+    for k in range(d):
+        lagged = values[:len(values)-k]
+        less[k:] += lagged < values[k:]
+        equal[k:] += lagged == values[k:]
+    count = window_reduce(valid.astype(np.float64), d, np.add, 0.)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out = (less + (equal + 1) / 2) / count
+    out[~valid | (count < min_periods)] = np.nan
+
+    return _wrap(out, x)
+
+
+def decay_linear(x, d, min_periods=None):
+    '''weighted mean over the last d dates with weights d, d-1, ..., 1 from the latest, weights of NaN dropped'''
+    min_periods = _check_window(d, min_periods)
+    values = _values(x)
+    j = np.arange(len(values), dtype=np.float64).reshape((-1,) + (1,) * (values.ndim - 1))
+    (s, sj), count, valid = _sums(d, min_periods, values, values * j)
+    wj = window_reduce(np.where(valid, j, 0.), d, np.add, 0.)
+
+    # weight of date j in the window ending at t is j - (t - d), i.e. d for t and 1 for t - d + 1
+    offset = j - d
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out = (sj - offset * s) / (wj - offset * count)
+
+    return _wrap(out, x)
+
+
+def cs_rank(x):
+    '''percentile rank of stocks on each date, ties averaged, NaN kept, like rank(axis=1, pct=True)'''
+    values = _values(x)
+    out = pd.DataFrame(values).rank(axis=1, pct=True).values
+
+    return _wrap(out, x)
+
+
+def cs_zscore(x):
+    '''values standardized across stocks on each date, ddof of 1 like pandas std'''
+    values = _values(x)
+    count = (~np.isnan(values)).sum(axis=1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.nansum(values, axis=1, keepdims=True) / count
+        centered = values - mean
+        std = np.sqrt(np.nansum(centered * centered, axis=1, keepdims=True) / (count - 1))
+        out = centered / std
+
+    return _wrap(out, x)
+
+
+def cs_neutralize(x, *exposures):
+    '''residuals of x regressed on exposures (with intercept) across stocks on each date, over stocks where
+    x and all exposures are valid, NaN elsewhere.
+    Params:
+        x: dates x stocks values
+        exposures: dates x stocks values each, e.g. log market cap; a date with fewer valid stocks than
+            regressors is left NaN
+    '''
+    values = _values(x)
+    factors = [_values(e) for e in exposures]
+    out = np.full(values.shape, np.nan)
+    valid = ~np.isnan(values)
+    for e in factors:
+        valid &= ~np.isnan(e)
+
+    if len(factors) == 1:
+        # closed form of a single regressor, vectorized over dates
+        count = valid.sum(axis=1, keepdims=True)
+        a = np.where(valid, values, 0.)
+        b = np.where(valid, factors[0], 0.)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            a = np.where(valid, a - a.sum(axis=1, keepdims=True) / count, 0.)
+            b = np.where(valid, b - b.sum(axis=1, keepdims=True) / count, 0.)
+            beta = (a * b).sum(axis=1, keepdims=True) / (b * b).sum(axis=1, keepdims=True)
+            res = a - np.where(np.isfinite(beta), beta, 0.) * b
+        out[valid] = res[valid]
+        out[(count < 2)[:, 0]] = np.nan
+        return _wrap(out, x)
+
+    for i in range(len(values)):
+        rows = valid[i]
+        if rows.sum() <= len(factors):
+            continue
+        design = np.column_stack([np.ones(rows.sum())] + [e[i, rows] for e in factors])
+        beta = np.linalg.lstsq(design, values[i, rows], rcond=None)[0]
+        out[i, rows] = values[i, rows] - design @ beta
+
+    return _wrap(out, x)
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+# per-factor stage instrumentation: wall time, cpu time, peak rss and bytes read of each stage.
+# stages nest, e.g. minute_load is also counted in definition.
+
+import os
+import time
+import json
+import resource
+from contextlib import contextmanager
+from collections import OrderedDict
+
+from framework.config import conf
+
+
+def read_bytes():
+    '''bytes read by this process through read syscalls, None if unavailable'''
+    try:
+        with open('/proc/self/io', 'r') as f:
+            for line in f:
+                if line.startswith('rchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+
+    return None
+
+
+def peak_rss_mb():
+    '''peak rss in MB since the last reset_peak_rss(), or since the process started'''
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024.
+    except OSError:
+        pass
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+def reset_peak_rss():
+    '''reset peak rss to the current rss, so that a pool worker does not carry the peak of earlier factors.
+    True if reset, False where unsupported (not Linux), peak_rss_mb() is then the peak since the process started.
+    '''
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+class Profiler(object):
+    '''Accumulates resource usage of named stages of one factor.
+    Params:
+        name: str, factor name
+
+    Returns:
+        Profiler, use stage() as a context manager and summary() to get flat stats.
+    '''
+    def __init__(self, name):
+        self.name_ = name
+        self.stages_ = OrderedDict()
+        self.open_ = []
+
+
+    def stats(self, name):
+        return self.stages_.setdefault(name, {'calls': 0, 'wall': 0., 'cpu': 0., 'read_mb': 0., 'peak_rss_mb': 0.})
+
+
+    @contextmanager
+    def stage(self, name):
+        wall, cpu, nbytes = time.perf_counter(), time.process_time(), read_bytes()
+        self.open_.append(name)
+        try:
+            yield
+        finally:
+            self.open_.pop()
+            st = self.stats(name)
+            st['calls'] += 1
+            st['wall'] += time.perf_counter() - wall
+            st['cpu'] += time.process_time() - cpu
+            if nbytes is not None:
+                st['read_mb'] += (read_bytes() - nbytes) / 2**20
+            st['peak_rss_mb'] = max(st['peak_rss_mb'], peak_rss_mb())
+
+
+    def add(self, name, wall, cpu):
+        '''time of stage name spent outside this process, e.g. a share of work done once for many factors,
+        counted in the stages open now as well
+        '''
+        self.stats(name)['calls'] += 1
+        for stage in set([name] + self.open_):
+            self.stats(stage)['wall'] += wall
+            self.stats(stage)['cpu'] += cpu
+
+
+    def summary(self):
+        '''flat dict like {'definition_wall': 1.2, ...}'''
+        stats = OrderedDict()
+        for stage, st in self.stages_.items():
+            for k, v in st.items():
+                stats[f'{stage}_{k}'] = round(v, 4) if isinstance(v, float) else v
+
+        return stats
+
+
+    def dump(self, path):
+        '''append a json line of the stats to path'''
+        record = {'factor': self.name_, 'pid': os.getpid(), 'time': time.strftime(r'%Y-%m-%d %H:%M:%S')}
+        record['stages'] = self.stages_
+        with open(path, 'a') as f:
+            f.write(json.dumps(record)+'\n')
+
+
+_active = None
+
+@contextmanager
+def profile(name):
+    '''profile stages of factor name within the block, written to conf['profile_log'] if configured'''
+    global _active
+    if _active is None:
+        reset_peak_rss() # a nested profile keeps the peak of the outer one
+    prev, _active = _active, Profiler(name)
+    profiler = _active
+    try:
+        with profiler.stage('total'):
+            yield profiler
+    finally:
+        _active = prev
+        if conf.get('profile_log', ''):
+            profiler.dump(conf.get('profile_log', ''))
+
+
+def record(name, wall, cpu):
+    '''add time of a stage spent elsewhere to the factor being profiled, a no-op if nothing is profiled'''
+    if _active is not None:
+        _active.add(name, wall, cpu)
+
+
+@contextmanager
+def stage(name):
+    '''time a stage of the factor being profiled, a no-op if nothing is profiled'''
+    if _active is None:
+        yield
+    else:
+        with _active.stage(name):
+            yield
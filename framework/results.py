@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+# sqlite sink of batch results: specs of each factor are committed as soon as it is checked, so a batch can be
+# monitored while running and resumed after a crash without recomputing finished factors.
+# result cache: value and excess files and specs of checked factors, keyed by a hash of everything they depend on.
+
+import os
+import json
+import time
+import shutil
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+
+class ResultSink(object):
+    '''Specs of checked factors in a sqlite db, keyed by factor name and settings of the check.
+    Params:
+        path: str, path to the sqlite db, created if missing
+
+    Returns:
+        ResultSink, use put() to store specs of a factor and get() to read them back.
+    '''
+    def __init__(self, path):
+        self.path_ = path
+        self.conn_ = sqlite3.connect(path)
+        self.conn_.execute(
+            'CREATE TABLE IF NOT EXISTS results '
+            '(factor TEXT, settings TEXT, specs TEXT, finished TEXT, PRIMARY KEY (factor, settings))'
+        )
+        self.conn_.commit()
+
+
+    @staticmethod
+    def settings_key(settings):
+        return json.dumps(settings, sort_keys=True)
+
+
+    def put(self, specs, settings):
+        '''store specs (pandas.Series named by factor) checked with settings, replacing a previous record'''
+        values = {k: v.item() if isinstance(v, np.generic) else v for k, v in specs.items()}
+        self.conn_.execute(
+            'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)',
+            (specs.name, self.settings_key(settings), json.dumps(values), time.strftime(r'%Y-%m-%d %H:%M:%S'))
+        )
+        self.conn_.commit()
+
+
+    def factors(self, settings):
+        '''names of factors already checked with settings'''
+        rows = self.conn_.execute('SELECT factor FROM results WHERE settings = ?', (self.settings_key(settings),))
+
+        return set([r[0] for r in rows])
+
+
+    def get(self, factor_name, settings):
+        '''specs of factor_name checked with settings, None if not found'''
+        row = self.conn_.execute(
+            'SELECT specs FROM results WHERE factor = ? AND settings = ?', (factor_name, self.settings_key(settings))
+        ).fetchone()
+        if row is None:
+            return None
+
+        return pd.Series(json.loads(row[0]), name=factor_name, dtype=object)
+
+
+    def close(self):
+        self.conn_.close()
+
+
+class ResultCache(object):
+    '''Copies of value and excess files and specs of checked factors, one dir per key under root.
+    Keys are <factor>_<hash>, only the last keep keys of a factor put or restored are kept, older ones are removed.
+    Params:
+        root: str, dir of the cache
+        keep: int, number of keys kept per factor, e.g. for checks at other transaction times
+
+    Returns:
+        ResultCache, use put() after a factor is checked and restore() to bring back its files and specs.
+    '''
+    def __init__(self, root, keep=3):
+        self.root_ = root
+        self.keep_ = keep
+
+
+    def put(self, key, files, specs):
+        '''keep copies of files and specs under key'''
+        key_dir = self.root_+key+'/'
+        os.makedirs(key_dir, exist_ok=True)
+        for f in files:
+            shutil.copyfile(f, key_dir+os.path.basename(f))
+        # specs last, a key without specs is incomplete
+        pd.to_pickle(specs, key_dir+'specs.pkl')
+        self.prune(key)
+
+
+    def restore(self, key, files):
+        '''copy cached files back to paths files and return specs, None if key is not cached'''
+        key_dir = self.root_+key+'/'
+        if not os.path.exists(key_dir+'specs.pkl'):
+            return None
+        if not all([os.path.exists(key_dir+os.path.basename(f)) for f in files]):
+            return None
+        for f in files:
+            shutil.copyfile(key_dir+os.path.basename(f), f)
+        os.utime(key_dir+'specs.pkl') # mtime of specs is the last use of a key
+
+        return pd.read_pickle(key_dir+'specs.pkl')
+
+
+    def prune(self, key):
+        '''remove keys of the factor of key but the last keep used, key itself always kept'''
+        factor, _ = key.rsplit('_', 1)
+        keys = []
+        for d in os.listdir(self.root_):
+            name, _, digest = d.rpartition('_')
+            if (name == factor) and (d != key) and (len(digest) == 16) and os.path.isdir(self.root_+d):
+                specs_file = self.root_+d+'/specs.pkl'
+                keys.append((os.path.getmtime(specs_file) if os.path.exists(specs_file) else 0., d))
+        for _, d in sorted(keys, reverse=True)[max(self.keep_-1, 0):]:
+            shutil.rmtree(self.root_+d, ignore_errors=True)
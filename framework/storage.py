@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+# storage of factor values and excess, pickle by default or float32 parquet (requires pyarrow), which can be read
+# by date range and column subset without loading the whole file.
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from framework.config import conf
+
+
+_extensions = {'pickle': '.pkl', 'parquet': '.parquet'}
+_date_col = '__date__' # name of an unnamed date index in parquet files
+
+
+def frame_file(dir_path, name):
+    '''path to write frame name under dir_path, in the format of conf['storage_format']'''
+    return dir_path+name+_extensions[conf.get('storage_format', 'pickle')]
+
+
+def find_frame(dir_path, name):
+    '''path to an existing frame name under dir_path in any format, the configured one first; None if not found'''
+    fmt = conf.get('storage_format', 'pickle')
+    for ext in [_extensions[fmt]] + [e for f, e in _extensions.items() if f != fmt]:
+        if os.path.exists(dir_path+name+ext):
+            return dir_path+name+ext
+
+    return None
+
+
+def write_frame(df, path):
+    '''write df to path, format by extension. parquet files hold float32 values.'''
+    if not path.endswith('.parquet'):
+        df.to_pickle(path)
+        return
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    df = df.astype(np.float32)
+    if isinstance(df.index, pd.DatetimeIndex) and (df.index.name is None):
+        df = df.rename_axis(_date_col)
+    table = pa.Table.from_pandas(df)
+    pq.write_table(table, path, compression=conf.get('storage_compression', 'zstd'), row_group_size=conf.get('storage_row_group', 20))
+
+
+def read_frame(path, start=None, end=None, columns=None):
+    '''read frame at path, format by extension.
+    Params:
+        path: str, path to .pkl or .parquet file
+        start, end: str or pandas.Timestamp, date range to read, both included. for frames indexed by date only
+        columns: list, columns to read, tuples for multi-level columns. KeyError if any of them is missing.
+
+    Returns:
+        pandas.DataFrame
+    '''
+    start = None if start is None else pd.Timestamp(start)
+    end = None if end is None else pd.Timestamp(end)
+
+    if not path.endswith('.parquet'):
+        df = pd.read_pickle(path)
+        if columns is not None:
+            df = df[columns]
+        if (start is not None) or (end is not None):
+            df = df.loc[start:end]
+        return df
+
+    import pyarrow.parquet as pq
+
+    schema = pq.read_schema(path)
+    index_cols = [c for c in schema.pandas_metadata['index_columns'] if isinstance(c, str)]
+    read_cols = None
+    if columns is not None:
+        read_cols = [str(c) for c in columns]
+        missing = [c for c in read_cols if c not in schema.names]
+        if len(missing) > 0:
+            raise KeyError(missing)
+        read_cols = read_cols + index_cols
+
+    filters = []
+    if index_cols == [_date_col]:
+        if start is not None:
+            filters.append((_date_col, '>=', start))
+        if end is not None:
+            filters.append((_date_col, '<=', end))
+    df = pq.read_table(path, columns=read_cols, filters=filters if filters else None).to_pandas()
+    if df.index.name == _date_col:
+        df.index.name = None
+    elif (start is not None) or (end is not None):
+        df = df.loc[start:end]
+
+    return df
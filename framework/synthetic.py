@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+
+# synthetic data tree with the layout of daily_data_path, minute_data_path, valid_minute_path and the reference
+# files, so the framework can be run and benchmarked without the production data.
+
+import os
+import json
+
+import numpy as np
+import pandas as pd
+
+
+_minute_fields = ['Open', 'High', 'Low', 'Close', 'Volume', 'Amount']
+_transaction_times = ['0935', '1000', '1300', '1450', '1500'] # of the reference factors
+
+
+def trading_minutes():
+    '''HHMM of the 240 minute bars of a day, 0931-1130 and 1301-1500'''
+    am = pd.date_range('2000-01-01 09:31', '2000-01-01 11:30', freq='min')
+    pm = am + pd.Timedelta('210min')
+
+    return am.append(pm).strftime(r'%H%M').tolist()
+
+
+def data_conf(root):
+    '''conf entries pointing at a synthetic data tree under root'''
+    root = os.path.join(root, '')
+    return {
+        'daily_data_path': root+'daily/',
+        'minute_data_path': root+'minute/',
+        'valid_minute_path': root+'valid/',
+        'valid_factors_file': root+'valid_factors.pkl',
+        'all_kfc_excess_file': root+'kfc_excess.pkl',
+        'all_hf_excess_file': root+'hf_excess.pkl',
+    }
+
+
+def generate_data(root, n_stocks=200, n_days=420, start_date='20180101', seed=0):
+    '''write a synthetic data tree under root, skipped if one with the same settings is already there.
+    prices follow geometric random walks with occasional limit moves and dividends, stocks are suspended at
+    random (NaN minute bars, is_valid_raw 0), a third of stocks are ChiNext (300xxx) with wider price limits.
+    Params:
+        root: str, dir of the data tree
+        n_stocks: int, number of stocks
+        n_days: int, number of trading days (weekdays from start_date)
+        start_date: str, first date
+        seed: int, seed of the random generator
+
+    Returns:
+        dict, conf entries pointing at the data tree, see data_conf
+    '''
+    root = os.path.join(root, '')
+    spec = {'n_stocks': n_stocks, 'n_days': n_days, 'start_date': start_date, 'seed': seed, 'valid_minutes': 'all'}
+    spec_file = root+'synthetic.json'
+    if os.path.exists(spec_file):
+        with open(spec_file, 'r') as f:
+            if json.load(f) == spec:
+                return data_conf(root)
+
+    paths = data_conf(root)
+    for p in [paths['daily_data_path'], paths['valid_minute_path']] + [paths['minute_data_path']+f for f in _minute_fields]:
+        os.makedirs(p, exist_ok=True)
+
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(start_date, periods=n_days)
+    stocks = [f'{300000+i:06d}.SZ' if i % 3 == 0 else f'{i:06d}.SZ' if i % 3 == 1 else f'{600000+i:06d}.SH' for i in range(n_stocks)]
+    cyb = np.array([s.startswith('3') for s in stocks])
+
+    # daily bars
+    limit = np.where(cyb & (dates >= pd.Timestamp('20200824'))[:, None], 0.2, 0.1)
+    daily_ret = np.clip(rng.normal(0.0003, 0.025, (n_days, n_stocks)) + rng.normal(0, 0.01, (n_days, 1)), -limit, limit)
+    limit_up = rng.random(daily_ret.shape) < 0.005
+    daily_ret[limit_up] = limit[limit_up]
+    close = 10 * np.exp(rng.normal(0, 0.5, n_stocks)) * np.cumprod(1 + daily_ret, axis=0)
+    pre_close = np.vstack([close[:1] / (1 + daily_ret[:1]), close[:-1]])
+    vwap = pre_close + (close - pre_close) * rng.uniform(0.3, 0.7, close.shape)
+    adjfactor = np.cumprod(np.where(rng.random(close.shape) < 0.002, 1.05, 1.), axis=0)
+    suspended = np.zeros(close.shape, dtype=bool)
+    for i in np.flatnonzero(rng.random(n_stocks) < 0.2):
+        d0 = rng.integers(0, n_days)
+        suspended[d0:d0+rng.integers(1, 20), i] = True
+    is_valid_raw = (~suspended).astype(np.float64)
+    volume = np.where(suspended, 0., np.exp(rng.normal(14, 1, close.shape)))
+
+    daily = {
+        'adjfactor': adjfactor, 'close': close, 'pre_close': pre_close, 'vwap': vwap, 'is_valid_raw': is_valid_raw,
+        'volume': volume, 'amount': volume * vwap,
+        'open': pre_close * (1 + rng.normal(0, 0.005, close.shape)),
+        'high': np.maximum(close, pre_close) * (1 + np.abs(rng.normal(0, 0.01, close.shape))),
+        'low': np.minimum(close, pre_close) * (1 - np.abs(rng.normal(0, 0.01, close.shape))),
+    }
+    for name, values in daily.items():
+        pd.DataFrame(values, index=dates, columns=stocks).to_pickle(paths['daily_data_path']+name+'.pkl')
+
+    # minute bars, a brownian bridge from pre_close to close with u-shaped volume
+    minutes = trading_minutes()
+    n_min = len(minutes)
+    shape = np.concatenate([np.linspace(2, 1, n_min//2), np.linspace(1, 1.5, n_min - n_min//2)])
+    for i, date in enumerate(dates):
+        ds = date.strftime(r'%Y%m%d')
+        index = pd.to_datetime([ds+m for m in minutes], format=r'%Y%m%d%H%M')
+        walk = np.cumsum(rng.normal(0, 0.001, (n_min, n_stocks)), axis=0)
+        walk -= np.linspace(0, 1, n_min)[:, None] * walk[-1]
+        log_ret = np.log(close[i] / pre_close[i])
+        bar_close = pre_close[i] * np.exp(np.linspace(0, 1, n_min)[:, None] * log_ret + walk)
+        bar_open = np.vstack([daily['open'][i][None, :], bar_close[:-1]])
+        spread = np.abs(rng.normal(0, 0.0005, (n_min, n_stocks)))
+        bar_volume = np.round(shape[:, None] * rng.gamma(2., volume[i] / n_min / 2 / shape.mean(), (n_min, n_stocks)), -2)
+        bar_volume[rng.random(bar_volume.shape) < 0.02] = 0.
+        bars = {
+            'Open': bar_open, 'Close': bar_close, 'Volume': bar_volume,
+            'High': np.maximum(bar_open, bar_close) * (1 + spread),
+            'Low': np.minimum(bar_open, bar_close) * (1 - spread),
+            'Amount': bar_volume * (bar_open + bar_close) / 2,
+        }
+        for field, values in bars.items():
+            values[:, suspended[i]] = np.nan
+            pd.DataFrame(values, index=index, columns=stocks).to_pickle(paths['minute_data_path']+field+'/'+ds+'.pkl')
+
+    # valid minutes, False when suspended or at a price limit, for every bar so that any transaction time can be
+    # checked. other bars draw from their own generator, leaving the data of the reference times as before
+    other_rng = np.random.default_rng([seed, 1])
+    for tt in _transaction_times + [m for m in minutes if m not in _transaction_times]:
+        draw = rng if tt in _transaction_times else other_rng
+        valid = ~suspended & (draw.random(close.shape) > 0.01)
+        pd.DataFrame(valid, index=dates, columns=stocks).to_pickle(paths['valid_minute_path']+tt+'.pkl')
+
+    # reference factors for TEST-3: group excess returns indexed by (group, date)
+    def excess(names):
+        index = pd.MultiIndex.from_product([np.arange(1, 21), dates[1:]])
+        values = rng.normal(0, 1, (len(index), len(names))) + np.repeat(np.linspace(-0.2, 0.2, 20), len(dates)-1)[:, None]
+        return pd.DataFrame(values, index=index, columns=names)
+
+    kfc_names = [f'KFC_Ref{i}' for i in range(5)]
+    excess(kfc_names).to_pickle(paths['all_kfc_excess_file'])
+    hf_names = {tt: [f'{cat}_Ref{i}' for i in range(5)] for cat, tt in zip(['KD', 'KH', 'KJ', 'KL'], _transaction_times[:-1])}
+    pd.concat({tt: excess(names) for tt, names in hf_names.items()}, axis=1).to_pickle(paths['all_hf_excess_file'])
+    valid_facs = [('1500', f) for f in kfc_names] + [(tt, f) for tt, names in hf_names.items() for f in names]
+    pd.Series(1, index=pd.MultiIndex.from_tuples(valid_facs)).to_pickle(paths['valid_factors_file'])
+
+    with open(spec_file, 'w') as f:
+        json.dump(spec, f)
+
+    return paths
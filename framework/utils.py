@@ -6,6 +6,12 @@ import pandas as pd
 from scipy import stats
 
 from framework.config import conf
+from framework.vwap import get_vwap
+from framework.minute_store import minute_digest
+from framework.manifest import file_manifest
+from framework.precision import float_dtype, to_precision
+from framework.cache import load_daily, load_pickle
+from framework.storage import read_frame
 
 
 def ttest_positive_sided(s, m):
@@ -30,6 +36,361 @@ def ttest_negative_sided(s, m):
     return oneside_p
 
 
+def factor_discriminability(factor_df):
+    '''per-date discriminability stats of factor values in one pass, each row sorted once.
+    Params:
+        factor_df: pandas.DataFrame, dates x stocks factor values
+
+    Returns:
+        tuple of (mean count of unique values incl. NaN, mean count of the most frequent value, ratio of NaN)
+    '''
+    values = np.sort(np.asarray(factor_df.values, dtype=np.float64), axis=1) # NaN sorted to the end
+    n, m = values.shape
+    isnan = np.isnan(values)
+    nan_ratio = np.round(isnan.mean(axis=1).mean(), 4)
+    n_valid = m - isnan.sum(axis=1)
+
+    starts = ~isnan
+    starts[:, 1:] &= values[:, 1:] != values[:, :-1]
+    unique_count = starts.sum(axis=1) + (n_valid < m) # NaN counts as one unique value
+
+    # run lengths of equal values, a run ends where the next one starts or at the first NaN
+    idx = np.flatnonzero(starts)
+    row, col = idx // m, idx % m
+    ends = n_valid[row]
+    same_row = row[1:] == row[:-1]
+    ends[:-1][same_row] = col[1:][same_row]
+    lengths = ends - col
+
+    mode_count = np.nan
+    if len(idx) > 0:
+        first = np.flatnonzero(np.r_[True, ~same_row])
+        mode_count = np.maximum.reduceat(lengths, first).mean() # rows of all NaN skipped
+
+    return unique_count.mean(), mode_count, nan_ratio
+
+
+def prediction_date_index(act_index):
+    '''trading dates of the return panel for activation dates act_index, i.e. one more date ahead'''
+    adjfactor = load_daily('adjfactor').loc[pd.Timestamp('20160101'):]
+    
+    assert len(set(act_index).difference(adjfactor.iloc[1:].index))==0, "please enter prediction dates between %s and %s" %(adjfactor.index[1], adjfactor.index[-1])
+    
+    # Generatge date_list for trade_price
+    idx_start = adjfactor.index.tolist().index(act_index[0]) - 1
+    idx_end = adjfactor.index.tolist().index(act_index[-1]) + 1
+
+    return adjfactor.iloc[idx_start:idx_end].index
+
+
+def ffill(values):
+    '''values (dates x stocks) with NaN filled by the last valid value of the stock, like fillna(method='pad')'''
+    idx = np.where(np.isnan(values), 0, np.arange(len(values))[:, None])
+    np.maximum.accumulate(idx, axis=0, out=idx)
+
+    return values[idx, np.arange(values.shape[1])]
+
+
+def daily_values(name, date_index, stocks):
+    '''values of daily field name on date_index as an array with columns stocks, missing ones filled with NaN'''
+    df = load_daily(name).loc[date_index]
+    if not df.columns.equals(stocks):
+        df = df.reindex(columns=stocks)
+
+    return df.values
+
+
+def compute_return_panel(date_index, act_type='close', buy_price='vwap', transaction_time='1500'):
+    '''excess returns of valid stocks on date_index[1:], independent of the factor to check.
+    see check_prediction for params. rules of valid stocks are fused into one mask, arrays are modified in place.
+    '''
+    stocks = load_daily('adjfactor').columns
+    adjfactor = daily_values('adjfactor', date_index, stocks)
+    vwap = daily_values('vwap', date_index, stocks)
+    pre_close = daily_values('pre_close', date_index, stocks)
+    # 创业板 from 20200824 with 20% price limits
+    cyb = (date_index >= pd.Timestamp('20200824'))[:, None] & np.array([s.startswith('3') for s in stocks])[None, :]
+
+    if act_type == 'close':
+        if buy_price == 'vwap': # buy_price为全天vwap
+            buy = vwap
+        elif buy_price == 'first_10m_vwap':
+            buy = get_vwap(date_index, 'first_10m').values
+        elif buy_price == 'pm_vwap':
+            buy = get_vwap(date_index, 'pm').values
+    else:
+        buy = get_vwap(date_index, 'minute', transaction_time).values
+
+    ret = np.full(vwap.shape, np.nan)
+    valid = np.zeros(vwap.shape, dtype=bool)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sell = vwap * adjfactor
+        if (act_type == 'close') and (buy_price == 'vwap'):
+            sell = ffill(sell) # the same as pct_change, which pads NaN
+            np.divide(sell[1:], sell[:-1], out=ret[1:])
+        else:
+            np.divide(sell[1:], buy[:-1] * adjfactor[:-1], out=ret[1:])
+        del sell
+        ret -= 1.
+        ret *= 100
+
+        # no price limit on the buy day
+        np.less(np.abs(buy[:-1] / pre_close[:-1] - 1.), np.where(cyb[1:], .198, .098), out=valid[1:])
+
+    is_valid_raw = daily_values('is_valid_raw', date_index, stocks) == 1
+    valid[1:] &= is_valid_raw[1:] & is_valid_raw[:-1]
+    valid &= np.isfinite(ret)
+    # 涨: 1.1*1.1/0.9-1=34.44% 跌: 0.9*0.9/1.1-1=-26.36%, 创业板 涨: 1.2*1.2/0.8-1=80.00% 跌: 0.8*0.8/1.2-1=-46.67%
+    valid &= ((ret < 33.) & (ret > -25.)) | (cyb & (ret < 78.) & (ret > -45.))
+
+    ret, valid = ret[1:], valid[1:]
+    ret[~valid] = 0.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ret -= (ret.sum(axis=1) / valid.sum(axis=1))[:, None]
+    ret[~valid] = np.nan
+
+    return to_precision(pd.DataFrame(ret, index=date_index[1:], columns=stocks))
+
+
+def return_panel_mtimes(date_index, act_type='close', buy_price='vwap'):
+    '''mtimes of the input files of a return panel on date_index, a cached panel is stale once any of them changes.
+    minute files of vwap buy prices are covered by a digest of the mtimes of each file on date_index.
+    '''
+    daily_path = conf.get('daily_data_path', '')
+    files = [daily_path+name+'.pkl' for name in ['adjfactor', 'is_valid_raw', 'vwap', 'pre_close']]
+    mtimes = [os.path.getmtime(f) if os.path.exists(f) else None for f in files]
+    if (act_type != 'close') or (buy_price != 'vwap'):
+        mtimes.append(minute_digest(['Amount', 'Volume'], date_index.strftime(r'%Y%m%d').tolist()))
+
+    return mtimes
+
+
+def write_cache(item, cache_file):
+    '''pickle item to cache_file through a tmp file, so that concurrent readers never see a partial file'''
+    os.makedirs(os.path.dirname(cache_file) or '.', exist_ok=True)
+    tmp_file = f'{cache_file}.{os.getpid()}.tmp'
+    pd.to_pickle(item, tmp_file)
+    os.replace(tmp_file, cache_file)
+
+
+_return_panels = {}
+
+def get_return_panel(date_index, act_type='close', buy_price='vwap', transaction_time='1500'):
+    '''cached compute_return_panel, computed once per (act_type, buy_price, transaction_time, date range) and
+    persisted under cache_dir if configured. the returned panel is shared and must not be modified in place.
+    '''
+    start, end = date_index[0].strftime(r'%Y%m%d'), date_index[-1].strftime(r'%Y%m%d')
+    key = f'ret_{act_type}_{buy_price}_{transaction_time}_{start}_{end}'
+    if float_dtype() != np.float64:
+        key += '_' + conf.get('precision', 'float64')
+    mtimes = return_panel_mtimes(date_index, act_type, buy_price)
+
+    item = _return_panels.get(key)
+    if (item is not None) and (item['mtimes'] == mtimes):
+        return item['ret']
+
+    cache_dir = conf.get('cache_dir', '')
+    cache_file = cache_dir+key+'.pkl'
+    item = None
+    if cache_dir and os.path.exists(cache_file):
+        item = pd.read_pickle(cache_file)
+        if item['mtimes'] != mtimes:
+            item = None
+
+    if item is None:
+        ret = compute_return_panel(date_index, act_type, buy_price, transaction_time)
+        item = {'mtimes': mtimes, 'ret': ret}
+        if cache_dir:
+            write_cache(item, cache_file)
+
+    _return_panels[key] = item
+
+    return item['ret']
+
+
+def frame_values(df, index, columns):
+    '''values of df on labels index and columns, a view if they are contiguous in df'''
+    def positions(loc):
+        if (len(loc) > 0) and np.array_equal(loc, np.arange(loc[0], loc[0]+len(loc))):
+            return slice(loc[0], loc[0]+len(loc))
+        return loc
+
+    rows, cols = positions(df.index.get_indexer(index)), positions(df.columns.get_indexer(columns))
+    if isinstance(rows, slice) or isinstance(cols, slice):
+        return df.values[rows][:, cols]
+
+    return df.values[np.ix_(rows, cols)]
+
+
+def valid_minutes(transaction_time, index, columns, lag):
+    '''valid minutes at transaction_time lagged by lag dates, as bool array on index x columns, False if missing'''
+    valid = load_pickle(conf.get('valid_minute_path', '')+transaction_time+'.pkl')
+    rows = valid.index.get_indexer(index)
+    if (rows < 0).any():
+        raise KeyError(index[rows < 0])
+    rows = rows - lag
+    cols = valid.columns.get_indexer(columns)
+    mask = valid.values[np.ix_(np.maximum(rows, 0), np.maximum(cols, 0))] == True
+    mask[rows < 0] = False
+    mask[:, cols < 0] = False
+
+    return mask
+
+
+def group_scores_batch(values, ret, group_number=20):
+    '''mean excess return of each quantile group, for a batch of factors scored against the same return panel.
+    Params:
+        values: numpy.ndarray, (factors x dates x stocks) or (dates x stocks) factor values aligned with ret
+        ret: numpy.ndarray, (dates x stocks) excess returns, NaN for invalid stocks
+        group_number: int, number of groups, group 1 holds the largest factor values
+
+    Returns:
+        numpy.ndarray, (factors x dates x group_number) or (dates x group_number) scores
+    '''
+    squeeze = values.ndim == 2
+    dtype = float_dtype()
+    # the only copy of values, NaN of ret propagated and negated in place. NaN are propagated the same as
+    # act.mul(ret).div(ret) with zeros replaced by ones: the round trip moves some values by an ulp, which decides
+    # the order of exactly tied values under method='first', so it is kept to rank ties as before
+    values = np.array(values, dtype=dtype).reshape((-1,) + ret.shape)
+    k, n, m = values.shape
+    ret_one = np.where(ret == 0, 1., ret)
+    values *= ret_one
+    values /= ret_one
+    del ret_one
+    np.negative(values, out=values)
+
+    # rank(method='first', ascending=False, pct=True) along stocks, NaN sorted to the end and left ungrouped.
+    # stocks are visited in rank order, so ranks are 1..m and no inverse permutation is needed
+    order = np.argsort(values, axis=2, kind='stable')
+    count = (~np.isnan(values)).sum(axis=2, keepdims=True).astype(dtype)
+    del values
+    rank = np.arange(1, m+1, dtype=dtype)[None, None, :]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pct = rank / count
+
+    # group i+1 holds i/group_number < pct <= (i+1)/group_number
+    bounds = (np.arange(1, group_number+1) / group_number).astype(dtype) # same rounding as pct
+    group = np.searchsorted(bounds, pct.ravel(), side='left').reshape(pct.shape)
+    del pct
+
+    valid = rank <= count
+    row = np.arange(k*n).reshape(k, n, 1)
+    flat = (row * group_number + group)[valid]
+    weights = ret[np.arange(n)[:, None], order][valid]
+
+    sums = np.bincount(flat, weights=weights, minlength=k*n*group_number)
+    counts = np.bincount(flat, minlength=k*n*group_number)
+    score = np.full(k*n*group_number, np.nan)
+    np.divide(sums, counts, out=score, where=counts > 0)
+    score = score.reshape(k, n, group_number)
+
+    return score[0] if squeeze else score
+
+
+def group_scores(act, ret, group_number=20):
+    '''quantile group scores of one factor, pandas wrapper of group_scores_batch.
+    Params:
+        act: pandas.DataFrame, factor values
+        ret: pandas.DataFrame, excess returns
+        group_number: int, number of groups
+
+    Returns:
+        pandas.DataFrame, dates x groups, columns 1..group_number
+    '''
+    # scored on common dates and stocks only, the others are NaN in either act or ret
+    index = act.index.union(ret.index)
+    rows, cols = act.index.intersection(ret.index), act.columns.intersection(ret.columns)
+    values = frame_values(act, rows, cols)
+    ret_values = frame_values(ret, rows, cols).astype(float_dtype(), copy=False)
+    score = group_scores_batch(values, ret_values, group_number)
+
+    return pd.DataFrame(score, index=rows, columns=np.arange(1, group_number+1)).reindex(index)
+
+
+def reference_mtimes(catalog_type):
+    files = [conf.get('valid_factors_file', ''), conf.get('all_kfc_excess_file' if catalog_type == 'KFC' else 'all_hf_excess_file', '')]
+
+    return [os.path.getmtime(f) if os.path.exists(f) else None for f in files]
+
+
+def compute_reference_top_returns(transaction_time, catalog_type):
+    '''top group excess returns of the valid reference factors at transaction_time.
+    raises KeyError if no reference is available for transaction_time.
+    '''
+    valid_facs = pd.read_pickle(conf.get('valid_factors_file', None)).loc[transaction_time].index
+    if catalog_type == 'KFC':
+        fac_all = read_frame(conf.get('all_kfc_excess_file', None), columns=list(valid_facs))
+    else:
+        fac_all = read_frame(conf.get('all_hf_excess_file', None), columns=[(transaction_time, f) for f in valid_facs])[transaction_time]
+
+    fac_top_group = fac_all.groupby(level=0).mean().idxmax()
+    fac_top_rets = pd.concat({c: fac_all[c].loc[fac_top_group[c]] for c in fac_all.columns}, axis=1)
+
+    return fac_top_rets.index, fac_top_rets.columns, fac_top_rets.values.astype(np.float32)
+
+
+_references = {}
+
+def reference_top_returns(transaction_time, catalog_type):
+    '''cached compute_reference_top_returns, built once per transaction time and persisted under cache_dir.
+    Returns:
+        tuple of (dates, factor names, float32 array of dates x factors)
+    '''
+    kind = 'kfc' if catalog_type == 'KFC' else 'hf'
+    key = f'ref_top_{kind}_{transaction_time}'
+    mtimes = reference_mtimes(catalog_type)
+
+    item = _references.get(key)
+    if (item is None) or (item['mtimes'] != mtimes):
+        cache_dir = conf.get('cache_dir', '')
+        cache_file = cache_dir+key+'.pkl'
+        item = None
+        if cache_dir and os.path.exists(cache_file):
+            item = pd.read_pickle(cache_file)
+            if item['mtimes'] != mtimes:
+                item = None
+
+        if item is None:
+            try:
+                ref = compute_reference_top_returns(transaction_time, catalog_type)
+            except KeyError:
+                ref = None
+            item = {'mtimes': mtimes, 'ref': ref}
+            if cache_dir:
+                write_cache(item, cache_file)
+        _references[key] = item
+
+    if item['ref'] is None:
+        raise KeyError(transaction_time)
+
+    return item['ref']
+
+
+def corr_columns(values, y):
+    '''pearson correlation of each column of values with y over pairwise non-NaN rows, like DataFrame.corrwith'''
+    values = np.asarray(values, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    ynan = np.isnan(y)
+    mask = ~np.isnan(values) & ~ynan[:, None]
+    x0 = np.where(mask, values, 0.)
+    y0 = np.where(ynan, 0., y)
+    maskf = mask.astype(np.float64)
+
+    n = maskf.sum(axis=0)
+    sx = x0.sum(axis=0)
+    sxx = (x0 * x0).sum(axis=0)
+    sy = maskf.T @ y0
+    syy = maskf.T @ (y0 * y0)
+    sxy = x0.T @ y0
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        corr = (n * sxy - sx * sy) / np.sqrt((n * sxx - sx * sx) * (n * syy - sy * sy))
+    corr[n < 2] = np.nan
+
+    return corr
+
+
 def check_prediction(activation, act_type='close', buy_price='vwap', transaction_time='1500', filter_close_fac=None, group_number=20):
     '''
     activation:
@@ -59,113 +420,32 @@ def check_prediction(activation, act_type='close', buy_price='vwap', transaction
     # assert span > 0 and isinstance(span, int)
     assert group_number > 0 and isinstance(group_number, int), 'wrong group_number'
     
-    act = activation.copy().astype(np.float64)
-    
-    basic_daily_path  = conf.get('daily_data_path', '')
-    basic_minute_path = conf.get('minute_data_path', '')
-    adjfactor = pd.read_pickle(basic_daily_path + 'adjfactor.pkl').loc[pd.Timestamp('20160101'):]
-    
-    assert len(set(act.index).difference(adjfactor.iloc[1:].index))==0, "please enter prediction dates between %s and %s" %(adjfactor.index[1], adjfactor.index[-1])
+    act = activation.to_numpy(dtype=float_dtype(), copy=True)
     
     '''    收益部分    '''
-    # Generatge date_list for trade_price
-    idx_start = adjfactor.index.tolist().index(act.index[0]) - 1
-    idx_end = adjfactor.index.tolist().index(act.index[-1]) + 1
-    date_index = adjfactor.iloc[idx_start:idx_end].index
-    date_list = sorted(date_index.strftime(r'%Y%m%d').tolist())
-    adjfactor = adjfactor.loc[date_index]
-    
-    is_valid_raw = pd.read_pickle(basic_daily_path + 'is_valid_raw.pkl').loc[date_index]
-    vwap = pd.read_pickle(basic_daily_path+'vwap.pkl').loc[date_index]
-    pre_close = pd.read_pickle(basic_daily_path+'pre_close.pkl').loc[date_index]
-    stocks_cyb = [col for col in adjfactor.columns if col.startswith('3')]
-    
-    if act_type == 'close':
-        if buy_price == 'vwap': # buy_price为全天vwap
-            ret = (vwap * adjfactor).pct_change(1) * 100
-            pct_change_buy_day = (vwap / pre_close - 1.).shift(1).abs()
-            
-        elif buy_price == 'first_10m_vwap':
-            vwap10 = pd.DataFrame(np.nan, index=date_index, columns=adjfactor.columns)
-            for date in date_list:
-                minute_amt = pd.read_pickle(basic_minute_path + 'Amount/' + date + '.pkl').iloc[:10].sum()
-                minute_vol = pd.read_pickle(basic_minute_path + 'Volume/' + date + '.pkl').iloc[:10].sum()
-                vwap10.loc[date] = minute_amt / minute_vol
-            
-            vwap10[np.isinf(vwap10)] = np.nan
-            ret = ((vwap * adjfactor) / (vwap10 * adjfactor).shift(1) - 1) * 100
-            pct_change_buy_day = (vwap10 / pre_close - 1.).shift(1).abs()
-        elif buy_price == 'pm_vwap':
-            vwap_pm = pd.DataFrame(np.nan, index=date_index, columns=adjfactor.columns)
-            for date in date_list:
-                minute_amt = pd.read_pickle(basic_minute_path + 'Amount/' + date + '.pkl').loc[date+'1300':date+'1456'].sum()
-                minute_vol = pd.read_pickle(basic_minute_path + 'Volume/' + date + '.pkl').loc[date+'1300':date+'1456'].sum()
-                vwap_pm.loc[date] = minute_amt / minute_vol
-            vwap_pm[np.isinf(vwap_pm)] = np.nan
-            
-            # ret = (vwap_pm * adjfactor).pct_change(1) * 100
-            ret = ((vwap * adjfactor) / (vwap_pm * adjfactor).shift(1) - 1.) * 100
-            pct_change_buy_day = (vwap_pm / pre_close - 1.).shift(1).abs()
-        
-    else:
-        vwapn = pd.DataFrame(np.nan, index=date_index, columns=adjfactor.columns)
-        for date in date_list:
-            minute_amt = pd.read_pickle(basic_minute_path + 'Amount/' + date + '.pkl').loc[pd.Timestamp(date+transaction_time+'00')]
-            minute_vol = pd.read_pickle(basic_minute_path + 'Volume/' + date + '.pkl').loc[pd.Timestamp(date+transaction_time+'00')]
-            vwapn.loc[date] = minute_amt / minute_vol
-            
-        vwapn[np.isinf(vwapn)] = np.nan
-        
-        ret = ((vwap * adjfactor) / (vwapn * adjfactor).shift(1) - 1) * 100
-        pct_change_buy_day = (vwapn / pre_close - 1.).shift(1).abs()
-        
-    nomaxupordown = pct_change_buy_day.lt(.098)
-    if date_list[-1] >= '20200824':
-        nomaxupordown.loc[pd.to_datetime('20200824'):, stocks_cyb] = pct_change_buy_day.loc[pd.to_datetime('20200824'):, stocks_cyb].lt(.198)
-
-    valid = (is_valid_raw.shift(1)==1) & (is_valid_raw==1) & (nomaxupordown) & (~np.isnan(ret)) & (~np.isinf(ret))
-    valid_ret = pd.DataFrame(False, index=valid.index, columns=valid.columns)
-    valid_ret[ret.lt(33.) & ret.gt(-25.)] = True # 涨: 1.1*1.1/0.9-1=34.44% 跌: 0.9*0.9/1.1-1=-26.36%
-    if date_list[-1] >= '20200824':
-        valid_ret_cyb = valid_ret.loc[pd.Timestamp('20200824'):, stocks_cyb].copy()
-        ret_cyb = ret.loc[pd.Timestamp('20200824'):, stocks_cyb].copy()
-        valid_ret_cyb[ret_cyb.lt(78.) & ret_cyb.gt(-45.)] = True # 涨: 1.2*1.2/0.8-1=80.00% 跌: 0.8*0.8/1.2-1=-46.67%
-        valid_ret.loc[pd.Timestamp('20200824'):, stocks_cyb] = valid_ret_cyb
-    valid = valid & valid_ret
-    ret = ret[valid].iloc[1:]
-    ret = ret.sub(ret.mean(axis=1), axis=0)
+    date_index = prediction_date_index(activation.index)
+    ret = get_return_panel(date_index, act_type, buy_price, transaction_time)
     
     if act_type == 'close':
         if isinstance(filter_close_fac, str) and os.path.exists(filter_close_fac):
-            with open(filter_close_fac) as f:
-                tt = f.readlines()
-            minute_flag = False
-            for line in tt:
-                if ('def definition(self' in line) or ('def definition(sef' in line):
-                    if 'Minute' in line:
-                        minute_flag = True
-                        break
+            # minute data in the args of definition
+            classes = file_manifest(filter_close_fac)['classes']
+            name = os.path.splitext(os.path.basename(filter_close_fac))[0]
+            minute_flag = classes[name]['minute_flag'] if name in classes else any([c['minute_flag'] for c in classes.values()])
         elif isinstance(filter_close_fac, bool):
             minute_flag = filter_close_fac
         else:
             raise TypeError('filter_close_fac should be either boolean or correct string path to a .py file')
 
         if minute_flag:
-            valid_noudlmt = pd.read_pickle(conf.get('valid_minute_path', '')+'1500.pkl').shift(2).loc[act.index]
-            act = act[valid_noudlmt==True]
+            act[~valid_minutes('1500', activation.index, activation.columns, 2)] = np.nan
         else:
             pass
     else:
-        valid_noudlmt = pd.read_pickle(conf.get('valid_minute_path', '')+transaction_time+'.pkl').shift(1).loc[act.index]
-        act = act[valid_noudlmt==True]
+        act[~valid_minutes(transaction_time, activation.index, activation.columns, 1)] = np.nan
     
     '''    分组部分    '''    
-    act = act.mul(ret.replace(0, 1)).div(ret.replace(0, 1))
-    act_rank = act.rank(axis=1, method='first', ascending=False, pct=True)
-
-    score = pd.DataFrame(index=act.index, columns=np.arange(1, group_number+1), data=np.nan)
-    for i in range(group_number):
-        score[i+1] = ret[act_rank.gt(i/group_number) & act_rank.le((i+1)/group_number)].mean(axis=1)
+    score = group_scores(pd.DataFrame(act, index=activation.index, columns=activation.columns), ret, group_number)
     
     return score
 
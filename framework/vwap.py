@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+
+# vwap panels used as buy prices by check_prediction: vwap of every minute, of the first 10 minutes and of the
+# afternoon. Amount and Volume minute files are scanned once for all of them, and persisted under cache_dir as
+# memory-mapped arrays when configured, so scoring at any transaction time is an array lookup.
+
+import os
+import json
+import fcntl
+
+import numpy as np
+import pandas as pd
+
+from framework.config import conf
+from framework.minute_store import read_minute, minute_mtimes
+from framework.cache import load_daily
+
+
+def scan_vwap(dates, stocks, minutes=None):
+    '''vwap panels of dates from one pass over Amount and Volume minute files.
+    Params:
+        dates: list of str, dates as YYYYMMDD
+        stocks: pandas.Index, stocks of the last axis, missing ones filled with NaN
+        minutes: list of str, minutes as HHMM to keep vwap of, default all minutes of the first date
+
+    Returns:
+        tuple of (dict of 'minute': days x minutes x stocks, 'first_10m', 'pm': days x stocks arrays, minutes)
+    '''
+    panels = None
+    for i, date in enumerate(dates):
+        amt = read_minute('Amount', date)
+        vol = read_minute('Volume', date)
+        hhmm = amt.index.hour * 100 + amt.index.minute # HHMM as int, strftime is slow
+        if panels is None:
+            minutes = [f'{m:04d}' for m in hhmm] if minutes is None else list(minutes)
+            missing = [m for m in minutes if int(m) not in set(hhmm)]
+            if len(missing) > 0:
+                raise KeyError(missing)
+            minutes_int = [int(m) for m in minutes]
+            panels = {
+                'minute': np.full((len(dates), len(minutes), len(stocks)), np.nan),
+                'first_10m': np.full((len(dates), len(stocks)), np.nan),
+                'pm': np.full((len(dates), len(stocks)), np.nan),
+            }
+        if not amt.columns.equals(stocks):
+            amt = amt.reindex(columns=stocks)
+        if not vol.columns.equals(stocks):
+            vol = vol.reindex(columns=stocks)
+        amt, vol = amt.values, vol.values
+        rows = pd.Index(hhmm).get_indexer(minutes_int)
+        pm = (hhmm >= 1300) & (hhmm <= 1456)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            vwap = amt[np.maximum(rows, 0)] / vol[np.maximum(rows, 0)]
+            vwap[rows < 0] = np.nan
+            panels['minute'][i] = vwap
+            # NaN skipped in sums like pandas, all NaN sums to 0
+            panels['first_10m'][i] = np.nansum(amt[:10], axis=0) / np.nansum(vol[:10], axis=0)
+            panels['pm'][i] = np.nansum(amt[pm], axis=0) / np.nansum(vol[pm], axis=0)
+
+    for v in panels.values():
+        v[np.isinf(v)] = np.nan
+
+    return panels, minutes
+
+
+def vwap_mtimes(dates):
+    '''mtimes of Amount and Volume minute files of dates, as dict of date to [amount, volume], None if missing.
+    the same mtimes key cached return panels (see minute_digest), so both are invalidated by the same changes.
+    '''
+    amount, volume = minute_mtimes('Amount', dates), minute_mtimes('Volume', dates)
+
+    return {date: [a, v] for date, a, v in zip(dates, amount, volume)}
+
+
+class VwapStore(object):
+    '''Memory-mapped vwap panels.
+    Layout under root: minute.f64 (days x minutes x stocks), first_10m.f64 and pm.f64 (days x stocks),
+    meta.json holds dates, minutes, stocks and mtimes of the minute files scanned for each date. Dates are appended
+    as they are requested, stored dates whose minute files changed since are scanned again.
+    Params:
+        root: str, dir of the store
+
+    Returns:
+        VwapStore, use update() to add dates and panel() to get a vwap panel.
+    '''
+    def __init__(self, root):
+        self.root_ = root
+        self.meta_ = None
+
+
+    def load_meta(self):
+        if not os.path.exists(self.root_+'meta.json'):
+            return None
+        with open(self.root_+'meta.json', 'r') as f:
+            meta = json.load(f)
+
+        return meta
+
+
+    def shape(self, kind, meta, n_dates=None):
+        n_dates = len(meta['dates']) if n_dates is None else n_dates
+        if kind == 'minute':
+            return (n_dates, len(meta['minutes']), len(meta['stocks']))
+        return (n_dates, len(meta['stocks']))
+
+
+    def save_meta(self, meta):
+        with open(self.root_+'meta.json.tmp', 'w') as f:
+            json.dump(meta, f)
+        os.replace(self.root_+'meta.json.tmp', self.root_+'meta.json')
+
+
+    def update(self, dates, stocks):
+        '''scan minute files of dates not stored yet or changed since stored, the store is rebuilt if stocks are not
+        all covered
+        '''
+        os.makedirs(self.root_, exist_ok=True)
+        mtimes = vwap_mtimes(dates)
+        with open(self.root_+'.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            meta = self.load_meta()
+            if (meta is not None) and (len(set(stocks).difference(meta['stocks'])) > 0):
+                meta = None
+            stored = [] if meta is None else meta['dates']
+            new_dates = sorted(set(dates).difference(stored))
+            if len(new_dates) > 0:
+                if (len(stored) > 0) and (new_dates[0] < stored[-1]):
+                    # dates before the last stored one, rebuild in date order
+                    meta, new_dates = None, sorted(set(dates).union(stored))
+                meta = self.append(meta, new_dates, stocks)
+            # stores of older versions have no mtimes, their dates are scanned again once
+            changed = [d for d in dates if meta.get('mtimes', {}).get(d) != mtimes[d]]
+            if len(changed) > 0:
+                meta = self.rescan(meta, changed)
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+        self.meta_ = meta
+        self.meta_['date_loc'] = {d: i for i, d in enumerate(meta['dates'])}
+
+
+    def append(self, meta, new_dates, stocks):
+        mtimes = vwap_mtimes(new_dates) # before the scan, so that a file changed during it is scanned again
+        panels, minutes = scan_vwap(new_dates, pd.Index(stocks) if meta is None else pd.Index(meta['stocks']),
+                                    None if meta is None else meta['minutes'])
+        if meta is None:
+            meta = {'dates': [], 'minutes': minutes, 'stocks': list(stocks), 'mtimes': {}}
+            for kind in panels:
+                open(self.root_+kind+'.f64', 'wb').close()
+
+        # days are the outermost axis, so appending days is appending bytes at the end of the file
+        for kind, values in panels.items():
+            with open(self.root_+kind+'.f64', 'ab') as f:
+                values.tofile(f)
+        meta = dict(meta, dates=meta['dates']+new_dates, mtimes=dict(meta.get('mtimes', {}), **mtimes))
+        self.save_meta(meta)
+
+        return meta
+
+
+    def rescan(self, meta, dates):
+        '''scan minute files of stored dates again and overwrite their rows in place'''
+        mtimes = vwap_mtimes(dates)
+        panels, _ = scan_vwap(dates, pd.Index(meta['stocks']), meta['minutes'])
+        date_loc = {d: i for i, d in enumerate(meta['dates'])}
+        rows = [date_loc[d] for d in dates]
+        for kind, values in panels.items():
+            arr = np.memmap(self.root_+kind+'.f64', dtype=np.float64, mode='r+', shape=self.shape(kind, meta))
+            arr[rows] = values
+            arr.flush()
+            del arr
+        meta = dict(meta, mtimes=dict(meta.get('mtimes', {}), **mtimes))
+        self.save_meta(meta)
+
+        return meta
+
+
+    def panel(self, kind, dates, transaction_time=None):
+        '''vwap of kind ('minute', 'first_10m' or 'pm') on dates as days x stocks array, at transaction_time for minute'''
+        arr = np.memmap(self.root_+kind+'.f64', dtype=np.float64, mode='r', shape=self.shape(kind, self.meta_))
+        rows = [self.meta_['date_loc'][d] for d in dates]
+        if kind == 'minute':
+            if transaction_time not in self.meta_['minutes']:
+                raise KeyError(transaction_time)
+            values = arr[rows, self.meta_['minutes'].index(transaction_time)]
+        else:
+            values = arr[rows]
+        del arr
+
+        return values
+
+
+_panels = {}
+_requested = {}
+
+def request_vwap(date_index, transaction_times):
+    '''minutes to be kept along with the next scan of minute files on date_index, so that scoring at each of
+    transaction_times, e.g. in a sweep, takes one scan instead of one per transaction time. nothing is scanned here,
+    and it is a no-op with cache_dir, where vwap of every minute is kept.
+    '''
+    dates = date_index.strftime(r'%Y%m%d').tolist()
+    key = (dates[0], dates[-1], len(dates))
+    _requested[key] = sorted(set(_requested.get(key, [])).union(transaction_times))
+
+
+def _memory_panels(dates, stocks, minutes):
+    '''in-process vwap panels of dates covering minutes, scanned again with minutes added or minute files changed'''
+    key = (dates[0], dates[-1], len(dates))
+    item = _panels.get(key)
+    mtimes = vwap_mtimes(dates)
+    if (item is None) or (item['mtimes'] != mtimes) or (len(set(minutes).difference(item['minutes'])) > 0):
+        kept = [] if item is None else item['minutes']
+        minutes = kept + sorted(set(minutes).union(_requested.pop(key, [])).difference(kept))
+        panels, minutes = scan_vwap(dates, stocks, minutes)
+        item = {'panels': panels, 'minutes': minutes, 'mtimes': mtimes}
+        _panels[key] = item
+
+    return item
+
+
+def get_vwap(date_index, kind='minute', transaction_time=None):
+    '''vwap panel on date_index with columns of adjfactor, persisted under cache_dir/vwap/ if configured.
+    Params:
+        date_index: pandas.DatetimeIndex, trading dates
+        kind: str, 'minute' for vwap of the bar at transaction_time, 'first_10m' for the first 10 bars of the day,
+            'pm' for bars between 1300 and 1456
+        transaction_time: str, HHMM, for kind 'minute' only
+
+    Returns:
+        pandas.DataFrame, dates x stocks. KeyError if transaction_time is not a minute of the data.
+    '''
+    stocks = load_daily('adjfactor').columns
+    dates = date_index.strftime(r'%Y%m%d').tolist()
+    cache_dir = conf.get('cache_dir', '')
+
+    if cache_dir:
+        store = VwapStore(cache_dir+'vwap/')
+        store.update(dates, stocks)
+        values = store.panel(kind, dates, transaction_time)
+        return pd.DataFrame(values, index=date_index, columns=store.meta_['stocks']).reindex(columns=stocks)
+
+    # without cache_dir only the requested minutes are kept, along with first_10m and pm of the same scan
+    item = _memory_panels(dates, stocks, [transaction_time] if kind == 'minute' else [])
+    if kind == 'minute':
+        values = item['panels']['minute'][:, item['minutes'].index(transaction_time)]
+    else:
+        values = item['panels'][kind]
+
+    return pd.DataFrame(values, index=date_index, columns=stocks)
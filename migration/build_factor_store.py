@@ -0,0 +1,56 @@
+#!/usr/local/anaconda3/bin/python
+## Tool to migrate existing factor value files into the consolidated factor store
+## factors already in the store are updated in place
+
+import os
+import sys
+import argparse
+
+prj_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, prj_path)
+
+from framework.config import conf
+from framework.storage import find_frame, read_frame
+from framework.factor_store import FactorStore
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Migrate factor value files to the consolidated factor store.')
+    parser.add_argument(
+        '-from_dir', dest='from_dir', type=str, default=prj_path+'/'+conf.get('factor_value_dir', 'factor_values'),
+        help='dir of factor value files (default: factor_value_dir in config.py)'
+    )
+    parser.add_argument(
+        '-to_dir', dest='to_dir', type=str, default=conf.get('factor_store_dir', ''),
+        help='dir of the factor store (default: factor_store_dir in config.py)'
+    )
+    parser.add_argument(
+        '-f', dest='fac_file', type=str, default=None, help='file contains list of factors (default: all files in from_dir)'
+    )
+    parser.add_argument(
+        'fac_name', nargs='*', default=None, help='factor name(s)'
+    )
+    args = parser.parse_args()
+
+    if not args.to_dir:
+        print('Please provide dir of the factor store!!!')
+        sys.exit(1)
+    from_dir = os.path.join(args.from_dir, '')
+    store = FactorStore(os.path.join(args.to_dir, ''))
+
+    fac_names = []
+    if args.fac_name is not None:
+        fac_names.extend(args.fac_name)
+    if args.fac_file is not None:
+        with open(os.path.abspath(args.fac_file), 'r') as f:
+            fac_names.extend([fac.strip() for fac in f])
+    if len(fac_names) < 1:
+        fac_names = sorted(set([os.path.splitext(f)[0] for f in os.listdir(from_dir) if f.endswith(('.pkl', '.parquet'))]))
+
+    for factor_name in fac_names:
+        path = find_frame(from_dir, factor_name)
+        if path is None:
+            print(f'{factor_name} skipped, no value file found')
+            continue
+        store.write(factor_name, read_frame(path))
+        print(f'{factor_name} migrated')
@@ -0,0 +1,44 @@
+#!/usr/local/anaconda3/bin/python
+## Tool to convert per-day minute pickles into the memory-mapped minute store
+## run again after new minute files arrived, only dates not yet converted will be appended
+
+import os
+import sys
+import argparse
+
+prj_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, prj_path)
+
+from framework.config import conf
+from framework.minute_store import build_minute_store
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert minute pickles to memory-mapped minute store.')
+    parser.add_argument(
+        '-to_dir', dest='to_dir', type=str, default=conf.get('minute_store_path', ''),
+        help='dir of the minute store (default: minute_store_path in config.py)'
+    )
+    parser.add_argument(
+        '-s', dest='start_date', type=str, default='20150101', help='first date to convert (default: 20150101)'
+    )
+    parser.add_argument(
+        'fields', nargs='*', default=['Amount', 'Volume', 'High', 'Low', 'Open', 'Close', 'Turnover'],
+        help='minute field(s) to convert (default: all)'
+    )
+    args = parser.parse_args()
+
+    if not args.to_dir:
+        print('Please provide dir of the minute store!!!')
+        sys.exit(1)
+    to_dir = os.path.join(args.to_dir, '')
+    os.makedirs(to_dir, exist_ok=True)
+
+    for field in args.fields:
+        field_dir = conf.get('minute_data_path', '')+field
+        if not os.path.isdir(field_dir):
+            print(f'{field} skipped, {field_dir} not found')
+            continue
+        dates = sorted([f[:-4] for f in os.listdir(field_dir) if f.endswith('.pkl') and f[:-4] >= args.start_date])
+        n = build_minute_store(field, dates, root=to_dir)
+        print(f'{field}: {n} dates appended')
@@ -0,0 +1,297 @@
+#!/usr/local/anaconda3/bin/python
+
+# -*- coding: utf-8 -*-
+# benchmark of the framework on synthetic data, results are written as json and compared against a baseline
+
+import os
+import io
+import sys
+import json
+import time
+import platform
+import tracemalloc
+import argparse
+from contextlib import redirect_stdout
+
+import numpy as np
+import pandas as pd
+
+prj_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, prj_path)
+
+from framework.config import conf
+from framework.core import AlphaFactorX
+from framework.synthetic import generate_data
+from framework.cache import get_cache
+from framework.profiling import peak_rss_mb
+from framework import ops
+import framework.utils as utils
+import framework.vwap as vwap
+
+
+class KFC_BenchMom(AlphaFactorX):
+    '''close factor of the benchmark, volume weighted momentum'''
+    def set_param(self):
+        params = {'prelength': 20, 'min_prelen': 0}
+        return params
+
+    def definition(self, close, adjfactor, volume):
+        ret = (close * adjfactor).pct_change(1)
+        df = (ret * volume).rolling(20).sum() / volume.rolling(20).sum()
+        return df.rank(axis=1)
+
+
+class KFC_BenchOps(AlphaFactorX):
+    '''close factor of the benchmark chaining operators of framework/ops.py'''
+    def set_param(self):
+        params = {'prelength': 20, 'min_prelen': 0}
+        return params
+
+    def definition(self, close, adjfactor, volume):
+        ret = ops.delta(close * adjfactor, 1) / ops.delay(close * adjfactor, 1)
+        df = ops.decay_linear(ops.ts_corr(ret, ops.cs_rank(volume), 10), 5) * ops.ts_rank(ops.ts_std(ret, 20), 10)
+        return ops.cs_zscore(df)
+
+
+class KH_BenchRange(AlphaFactorX):
+    '''minute factor of the benchmark evaluated day by day, price range before transaction scaled by last close'''
+    def set_param(self):
+        params = {'prelength': 0, 'min_prelen': 1}
+        return params
+
+    def definition(self, MinuteHigh, MinuteLow, MinuteVolume):
+        df = self.minute_help()
+        return df
+
+    def minute(self, MinuteHigh, MinuteLow, MinuteVolume, close):
+        high = MinuteHigh.sort_index().iloc[-60:]
+        low = MinuteLow.sort_index().iloc[-60:]
+        return (high.max() - low.min()) / close.iloc[-1] * np.log1p(MinuteVolume.sum())
+
+
+def reset_caches():
+    '''drop in-process caches, so every run is measured cold'''
+    get_cache().clear()
+    utils._return_panels.clear()
+    utils._references.clear()
+    vwap._panels.clear()
+
+
+def timeit(func, repeat):
+    '''wall times of repeat cold runs of func, and the result of the last run'''
+    runs = []
+    for _ in range(repeat):
+        reset_caches()
+        tic = time.perf_counter()
+        with redirect_stdout(io.StringIO()):
+            result = func()
+        runs.append(time.perf_counter() - tic)
+
+    return runs, result
+
+
+def peak_memory(func):
+    '''peak MB allocated during a cold run of func as traced by tracemalloc, numpy arrays included'''
+    reset_caches()
+    tracemalloc.start()
+    with redirect_stdout(io.StringIO()):
+        func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return peak / 2**20
+
+
+def run_benchmarks(start_date, repeat, cases=None):
+    '''time the stages of computing and checking factors.
+    Params:
+        start_date: str, start date of factor values
+        repeat: int, number of runs of each case, the fastest one is reported
+        cases: list of str, names of cases to run, default all
+
+    Returns:
+        dict of case name to {'min', 'mean', 'runs', 'peak_mb'}, times in seconds, peak_mb of an extra traced run
+    '''
+    from framework.bench import FactorComputerChecker
+    from factor_script.KH_Demo import KH_Demo
+
+    fcc = FactorComputerChecker(start_date=start_date, nproc=1)
+    close_value = KFC_BenchMom(start_date).calculate()
+    minute_value = KH_Demo(start_date).calculate()
+
+    fcc.catalog_type_, fcc.transaction_time_ = fcc.get_catalog('KFC_BenchMom')
+    discrim, _, nan_ratio = utils.factor_discriminability(close_value)
+    score = utils.check_prediction(close_value.shift(2), filter_close_fac=False)
+
+    benchmarks = {
+        'calculate/close': lambda: KFC_BenchMom(start_date).calculate(),
+        'calculate/close_ops': lambda: KFC_BenchOps(start_date).calculate(),
+        'calculate/minute_batch': lambda: KH_Demo(start_date).calculate(),
+        'minute_help/minute': lambda: KH_BenchRange(start_date).minute_help(),
+        'minute_help/minute_batch': lambda: KH_Demo(start_date).minute_help(),
+        'check_prediction/close/vwap': lambda: utils.check_prediction(close_value.shift(2), 'close', 'vwap', filter_close_fac=False),
+        'check_prediction/close/first_10m_vwap': lambda: utils.check_prediction(close_value.shift(2), 'close', 'first_10m_vwap', filter_close_fac=False),
+        'check_prediction/close/pm_vwap': lambda: utils.check_prediction(close_value.shift(2), 'close', 'pm_vwap', filter_close_fac=False),
+        'check_prediction/minute/vwap': lambda: utils.check_prediction(minute_value.shift(1), 'minute', 'vwap', '1000'),
+        'score_eval': lambda: fcc.score_eval('KFC_BenchMom', score, discrim, nan_ratio),
+    }
+
+    results = {}
+    for name, func in benchmarks.items():
+        if (cases is not None) and (name not in cases):
+            continue
+        runs, _ = timeit(func, repeat)
+        peak_mb = peak_memory(func)
+        results[name] = {'min': round(min(runs), 4), 'mean': round(float(np.mean(runs)), 4), 'runs': [round(r, 4) for r in runs],
+                         'peak_mb': round(peak_mb, 1)}
+        print(f'{name:40s} min {min(runs):8.3f}s  mean {np.mean(runs):8.3f}s  peak {peak_mb:8.1f}MB')
+
+    return results
+
+
+def precision_check(start_date):
+    '''compute and score the close and minute factors of the benchmark under float64 and float32.
+    Returns:
+        dict of factor name to {'value': max abs diff of factor values, 'score': max abs diff of mean group scores}
+    '''
+    from factor_script.KH_Demo import KH_Demo
+
+    cases = {
+        'KFC_BenchMom': (KFC_BenchMom, lambda v: utils.check_prediction(v.shift(2), filter_close_fac=False)),
+        'KH_Demo': (KH_Demo, lambda v: utils.check_prediction(v.shift(1), 'minute', 'vwap', '1000')),
+    }
+    precision = conf.get('precision', 'float64')
+    outputs = {}
+    for p in ['float64', 'float32']:
+        conf['precision'] = p
+        reset_caches()
+        with redirect_stdout(io.StringIO()):
+            for name, (cls, score) in cases.items():
+                value = cls(start_date).calculate()
+                outputs[(name, p)] = (value.astype(np.float64), score(value).mean())
+    conf['precision'] = precision
+
+    diffs = {}
+    for name in cases:
+        (v64, s64), (v32, s32) = outputs[(name, 'float64')], outputs[(name, 'float32')]
+        diffs[name] = {'value': float((v64 - v32).abs().max().max()), 'score': float((s64 - s32).abs().max())}
+        print(f'{name:40s} float32 vs float64: value {diffs[name]["value"]:.2e}  score {diffs[name]["score"]:.2e}')
+
+    return diffs
+
+
+def compare(results, baseline, tolerance):
+    '''cases slower or with higher peak memory than baseline by more than tolerance (relative), as dict of
+    case name (suffixed by /peak_mb for memory) to ratio
+    '''
+    regressions = {}
+    print(f'\n{"case":40s} {"baseline":>9s} {"current":>9s} {"ratio":>7s}')
+    for name, res in results.items():
+        if name not in baseline['results']:
+            continue
+        base = baseline['results'][name]['min']
+        ratio = res['min'] / base if base > 0 else np.nan
+        flag = ''
+        if ratio > 1 + tolerance:
+            regressions[name] = round(ratio, 4)
+            flag = ' <- regression'
+        print(f'{name:40s} {base:9.3f} {res["min"]:9.3f} {ratio:7.2f}{flag}')
+
+        if ('peak_mb' in res) and ('peak_mb' in baseline['results'][name]):
+            base = baseline['results'][name]['peak_mb']
+            ratio = res['peak_mb'] / base if base > 0 else np.nan
+            flag = ''
+            if ratio > 1 + tolerance:
+                regressions[name+'/peak_mb'] = round(ratio, 4)
+                flag = ' <- regression'
+            print(f'{name+"/peak_mb":40s} {base:9.1f} {res["peak_mb"]:9.1f} {ratio:7.2f}{flag}')
+
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark computing and checking factors on synthetic data.')
+    parser.add_argument(
+        '-d', dest='data_dir', type=str, default='/tmp/afx_synthetic',
+        help='dir of the synthetic data tree, generated if missing (default: /tmp/afx_synthetic)'
+    )
+    parser.add_argument(
+        '--stocks', dest='n_stocks', type=int, default=200, help='number of stocks of synthetic data (default: 200)'
+    )
+    parser.add_argument(
+        '--days', dest='n_days', type=int, default=420, help='number of days of synthetic data from 20180101 (default: 420)'
+    )
+    parser.add_argument(
+        '-s', dest='start_date', type=str, default='20180301', help='start date of factor values (default: 20180301)'
+    )
+    parser.add_argument(
+        '-r', dest='repeat', type=int, default=3, help='number of runs of each case, the fastest is reported (default: 3)'
+    )
+    parser.add_argument(
+        '-c', dest='cases', nargs='+', default=None, help='case(s) to run, e.g. score_eval (default: all)'
+    )
+    parser.add_argument(
+        '-o', dest='output', type=str, default=None, help='path to json file to write results (default: None)'
+    )
+    parser.add_argument(
+        '-b', dest='baseline', type=str, default=None, help='path to json results of a previous run to compare with (default: None)'
+    )
+    parser.add_argument(
+        '--tolerance', dest='tolerance', type=float, default=0.1,
+        help='relative slowdown or growth of peak memory against baseline reported as regression, exit code 1 if any (default: 0.1)'
+    )
+    parser.add_argument(
+        '--precision', dest='precision', type=str, default='float64', choices=['float64', 'float32'],
+        help='conf precision of the timed cases (default: float64)'
+    )
+    parser.add_argument(
+        '--score_tolerance', dest='score_tolerance', type=float, default=0.01,
+        help='max abs diff of mean group scores between float32 and float64, in percent, exit code 1 if exceeded (default: 0.01)'
+    )
+    args = parser.parse_args()
+
+    print('preparing synthetic data...')
+    conf.update(generate_data(args.data_dir, n_stocks=args.n_stocks, n_days=args.n_days))
+    conf.update({'minute_store_path': '', 'cache_dir': '', 'profile_log': '', 'precision': args.precision})
+
+    results = run_benchmarks(args.start_date, args.repeat, args.cases)
+    print()
+    precision = precision_check(args.start_date)
+    report = {
+        'meta': {
+            'time': time.strftime(r'%Y-%m-%d %H:%M:%S'),
+            'n_stocks': args.n_stocks,
+            'n_days': args.n_days,
+            'start_date': args.start_date,
+            'repeat': args.repeat,
+            'precision': args.precision,
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count(),
+            'peak_rss_mb': round(peak_rss_mb(), 1),
+        },
+        'results': results,
+        'precision': precision,
+    }
+
+    if args.output is not None:
+        with open(os.path.abspath(args.output), 'w') as f:
+            json.dump(report, f, indent=2)
+
+    failed = False
+    if any([d['score'] > args.score_tolerance for d in precision.values()]):
+        print(f'mean group scores under float32 differ from float64 by more than {args.score_tolerance}!!!')
+        failed = True
+
+    if args.baseline is not None:
+        with open(os.path.abspath(args.baseline), 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if len(regressions) > 0:
+            print(f'{len(regressions)} case(s) slower or larger than baseline by more than {args.tolerance:.0%}!!!')
+            failed = True
+
+    if failed:
+        sys.exit(1)